@@ -0,0 +1,129 @@
+# Copyright 2022, Charles Powell
+#
+# Compare Sense broadcast reply latency and HASS ingest throughput between event loop implementations
+#
+# Usage, from the repository root:
+# PYTHONPATH=. python benchmarks/loop_benchmark.py [--plugs 20] [--polls 200] [--events 20000]
+
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import time
+
+import websockets
+
+from senselink import SenseLink
+from senselink.common import use_event_loop
+from senselink.homeassistant import HAController, HASource
+from senselink.tplink_encryption import encrypt
+
+SENSE_QUERY = encrypt(json.dumps({"emeter": {"get_realtime": {}}, "system": {"get_sysinfo": {}}}))[4:]
+
+
+def free_port(kind=socket.SOCK_DGRAM):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def static_config(plug_count):
+    plugs = [{f'Plug{i}': {'mac': f'53:75:31:00:{i // 256:02x}:{i % 256:02x}', 'max_watts': i}}
+             for i in range(plug_count)]
+    return json.dumps({'sources': [{'static': {'plugs': plugs}}]})
+
+
+class ReplyCounter(asyncio.DatagramProtocol):
+    def __init__(self, expected):
+        self.expected = expected
+        self.received = 0
+        self.done = None
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if self.received >= self.expected and not self.done.done():
+            self.done.set_result(time.perf_counter())
+
+
+async def reply_latency(plug_count, polls):
+    # Time from sending a Sense poll to receiving every plug response
+    port = free_port()
+    server = SenseLink(static_config(plug_count), port=port)
+    server.create_instances()
+    server_task = asyncio.create_task(server.server_start())
+    await asyncio.sleep(0.1)
+
+    loop = asyncio.get_running_loop()
+    counter = ReplyCounter(plug_count)
+    transport, _ = await loop.create_datagram_endpoint(lambda: counter, remote_addr=('127.0.0.1', port))
+    latencies = []
+    for _ in range(polls):
+        counter.received = 0
+        counter.done = loop.create_future()
+        start = time.perf_counter()
+        transport.sendto(SENSE_QUERY)
+        end = await asyncio.wait_for(counter.done, 5)
+        latencies.append((end - start) * 1000)
+
+    transport.close()
+    server_task.cancel()
+    return latencies
+
+
+async def ingest_throughput(event_count):
+    # Rate at which HASS state_changed events are received and parsed over a local websocket
+    port = free_port(socket.SOCK_STREAM)
+    finished = asyncio.get_running_loop().create_future()
+
+    async def handler(ws):
+        await ws.send(json.dumps({"type": "auth_required"}))
+        await ws.recv()
+        await ws.send(json.dumps({"type": "auth_ok"}))
+        await ws.recv()
+        for i in range(event_count):
+            await ws.send(json.dumps({"id": 1, "type": "event", "event": {
+                "c": {"sensor.power": {"+": {"s": str(i)}}}}}))
+        await finished
+
+    controller = HAController(f'ws://127.0.0.1:{port}', 'token')
+    source = HASource('power', {'entity_id': 'sensor.power'}, controller)
+    async with websockets.serve(handler, '127.0.0.1', port):
+        client_task = asyncio.create_task(controller.connect())
+        start = time.perf_counter()
+        while source.power != event_count - 1:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        finished.set_result(True)
+        client_task.cancel()
+    return event_count / elapsed
+
+
+def run(loop_name, args):
+    selected = use_event_loop(loop_name)
+    if selected != loop_name:
+        return None
+    latencies = asyncio.run(reply_latency(args.plugs, args.polls))
+    rate = asyncio.run(ingest_throughput(args.events))
+    asyncio.set_event_loop_policy(None)
+    return {
+        'reply_p50_ms': statistics.median(latencies),
+        'reply_p95_ms': statistics.quantiles(latencies, n=20)[-1],
+        'ingest_per_s': rate,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plugs", help="number of plugs responding to each poll", type=int, default=20)
+    parser.add_argument("--polls", help="number of Sense polls to time", type=int, default=200)
+    parser.add_argument("--events", help="number of HASS events to ingest", type=int, default=20000)
+    args = parser.parse_args()
+
+    for name in ('asyncio', 'uvloop'):
+        results = run(name, args)
+        if results is None:
+            print(f"{name:8} not available")
+            continue
+        print(f"{name:8} reply p50 {results['reply_p50_ms']:.3f} ms, p95 {results['reply_p95_ms']:.3f} ms, "
+              f"ingest {results['ingest_per_s']:.0f} events/s")
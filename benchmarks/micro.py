@@ -0,0 +1,160 @@
+# Copyright 2022, Charles Powell
+#
+# Microbenchmarks of SenseLink's hot functions, with JSON baselines for spotting regressions
+#
+# Usage, from the repository root:
+# PYTHONPATH=. python benchmarks/micro.py [--save baseline.json] [--compare baseline.json] [--threshold 10] [-k filter]
+# Each benchmark reports the best time per call over several repeats. With --compare, exits with a non-zero
+# status if any benchmark is slower than the baseline by more than the threshold (percent).
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+from senselink.common import safekey, get_float_at_path
+from senselink.data_source import DataSource, AggregateSource
+from senselink.homeassistant import HAController, HASource
+from senselink.mqtt import MQTTController, MQTTSource
+from senselink.plug_instance import PlugInstance
+from senselink.senselink import SenseLinkProtocol
+from senselink.tplink_encryption import encrypt, decrypt
+
+SENSE_QUERY = encrypt(json.dumps({"emeter": {"get_realtime": {}}, "system": {"get_sysinfo": {}}}))[4:]
+SENSE_ADDR = ('127.0.0.1', 9999)
+
+
+class NullTransport:
+    def sendto(self, data, addr=None):
+        pass
+
+
+def run_coroutine(coro):
+    # Run a coroutine that never actually suspends, without an event loop
+    try:
+        coro.send(None)
+    except StopIteration:
+        pass
+
+
+def static_plugs(count):
+    plugs = {}
+    for i in range(count):
+        plug = PlugInstance(f'Plug{i}', mac=f'53:75:31:00:{i // 256:02x}:{i % 256:02x}', device_id=f'{i:040x}')
+        plug.data_source = DataSource(plug.identifier, {'max_watts': i})
+        plugs[plug.mac] = plug
+    return plugs
+
+
+def hass_message():
+    return {'entity_id': 'light.bench', 'new_state': {
+        'entity_id': 'light.bench', 'state': 'on', 'attributes': {'brightness': 128, 'friendly_name': 'Bench'}}}
+
+
+def benchmarks(args):
+    # Name to zero-argument callable
+    plug = next(iter(static_plugs(1).values()))
+    response_json = json.dumps(plug.generate_response())
+    encrypted = encrypt(response_json)
+
+    message = hass_message()
+    ha_source = HASource('bench', {'entity_id': 'light.bench', 'attribute': 'brightness', 'attribute_min': 0,
+                                   'attribute_max': 255, 'max_watts': 60}, HAController('ws://bench', 'token'))
+
+    mqtt_controller = MQTTController('bench')
+    mqtt_power = MQTTSource('power', {'power_topic': 'bench/power'}, mqtt_controller)
+    mqtt_keypath = MQTTSource('keypath', {'power_topic': 'bench/json', 'power_topic_keypath': 'sensor/power'},
+                              mqtt_controller)
+    mqtt_state = MQTTSource('state', {'state_topic': 'bench/state', 'max_watts': 40}, mqtt_controller)
+    json_payload = json.dumps({'sensor': {'power': 12.5}})
+
+    aggregate = AggregateSource('aggregate', {}, None)
+    aggregate.elements = list(static_plugs(args.plugs).values())
+
+    protocol = SenseLinkProtocol(static_plugs(args.plugs), None)
+    protocol.connection_made(NullTransport())
+
+    return {
+        'encrypt': lambda: encrypt(response_json),
+        'decrypt': lambda: decrypt(encrypted),
+        'generate_response': plug.generate_response,
+        'safekey': lambda: safekey(message, 'new_state/attributes/brightness'),
+        'get_float_at_path': lambda: get_float_at_path(message, 'new_state/attributes/brightness'),
+        'hass_parse_update': lambda: ha_source.parse_update('new_state/', message),
+        'mqtt_power_handler': lambda: run_coroutine(mqtt_power.power_handler('12.5')),
+        'mqtt_power_keypath': lambda: run_coroutine(mqtt_keypath.power_handler(json_payload)),
+        'mqtt_state_handler': lambda: run_coroutine(mqtt_state.state_handler('on')),
+        f'aggregate_power_{args.plugs}': lambda: aggregate.power,
+        f'datagram_received_{args.plugs}': lambda: protocol.datagram_received(SENSE_QUERY, SENSE_ADDR),
+    }
+
+
+def measure(func, repeat):
+    # Best time per call [seconds]
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def format_time(seconds):
+    if seconds < 1e-6:
+        return f'{seconds * 1e9:8.1f} ns'
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:8.2f} us'
+    return f'{seconds * 1e3:8.3f} ms'
+
+
+def compare(results, baseline, threshold):
+    # Print change against the baseline, returning the names of regressed benchmarks
+    regressions = []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:28} {format_time(seconds)}  (no baseline)")
+            continue
+        change = (seconds - base) / base * 100
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:28} {format_time(seconds)}  baseline {format_time(base)}  {change:+6.1f}%"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plugs", help="number of plugs for aggregate and protocol benchmarks", type=int, default=20)
+    parser.add_argument("--repeat", help="number of timing repeats (best is used)", type=int, default=5)
+    parser.add_argument("-k", "--filter", help="only run benchmarks with names containing this", default=None)
+    parser.add_argument("--save", help="save results as a JSON baseline to this path", default=None)
+    parser.add_argument("--compare", help="compare results to the JSON baseline at this path", default=None)
+    parser.add_argument("--threshold", help="regression threshold when comparing (percent)", type=float,
+                        default=10.0)
+    args = parser.parse_args()
+
+    results = {}
+    for name, func in benchmarks(args).items():
+        if args.filter is not None and args.filter not in name:
+            continue
+        results[name] = measure(func, args.repeat)
+
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"Comparing to baseline from Python {baseline['python']} ({args.compare})")
+        regressions = compare(results, baseline['results'], args.threshold)
+    else:
+        for name, seconds in results.items():
+            print(f"{name:28} {format_time(seconds)}")
+
+    if args.save is not None:
+        with open(args.save, 'w') as file:
+            json.dump({'python': platform.python_version(), 'plugs': args.plugs, 'results': results}, file, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if regressions:
+        print(f"FAILED: {len(regressions)} benchmark(s) regressed by more than {args.threshold}%: "
+              f"{', '.join(regressions)}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,185 @@
+# Copyright 2022, Charles Powell
+#
+# Long-running memory soak test: drives synthetic HASS, MQTT and Sense traffic through SenseLink (without any
+# network connections), periodically comparing tracemalloc snapshots to report the top growing allocation sites,
+# and checking that the number of asyncio tasks stays bounded.
+#
+# Usage, from the repository root:
+# PYTHONPATH=. python benchmarks/soak.py [--duration 3600] [--interval 60] [--plugs 50]
+# Exits with a non-zero status if memory growth or the task count exceed the specified limits.
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+
+from senselink import SenseLink
+from senselink.senselink import SenseLinkProtocol
+from senselink.tplink_encryption import encrypt
+
+SENSE_QUERY = encrypt(json.dumps({"emeter": {"get_realtime": {}}, "system": {"get_sysinfo": {}}}))[4:]
+SENSE_ADDR = ('127.0.0.1', 9999)
+
+
+class NullWebsocket:
+    async def send(self, message):
+        pass
+
+
+class NullTransport:
+    def sendto(self, data, addr=None):
+        pass
+
+
+def soak_config(plug_count):
+    hass_plugs = [{f'Hass{i}': {'mac': f'53:75:31:01:{i // 256:02x}:{i % 256:02x}',
+                                'entity_id': f'light.soak_{i}', 'attribute': 'brightness',
+                                'attribute_min': 0, 'attribute_max': 255, 'max_watts': 60}}
+                  for i in range(plug_count)]
+    mqtt_plugs = [{f'Mqtt{i}': {'mac': f'53:75:31:02:{i // 256:02x}:{i % 256:02x}',
+                                'power_topic': f'soak/{i}/power', 'timeout_duration': 5, 'lazy': i % 2 == 0}}
+                  for i in range(plug_count)]
+    mutable_plugs = [{f'Mutable{i}': {'mac': f'53:75:31:03:{i // 256:02x}:{i % 256:02x}'}}
+                     for i in range(plug_count)]
+    aggregate_plugs = [{'SoakAggregate': {'mac': '53:75:31:04:00:00',
+                                          'elements': [f'Mutable{i}' for i in range(plug_count)]}}]
+    return json.dumps({'sources': [
+        {'hass': {'url': 'ws://soak', 'auth_token': 'soak', 'plugs': hass_plugs}},
+        {'mqtt': {'host': 'soak', 'plugs': mqtt_plugs}},
+        {'mutable': {'plugs': mutable_plugs}},
+        {'aggregate': {'plugs': aggregate_plugs}},
+    ]})
+
+
+def filtered_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ))
+
+
+class Soak:
+    def __init__(self, args):
+        self.args = args
+        self.server = SenseLink(soak_config(args.plugs))
+        self.server.create_instances()
+        # Controllers are driven directly, not connected
+        for task in self.server.tasks:
+            task.close()
+        self.server.tasks = set()
+        self.hass = self.server.hass_controllers[0]
+        self.mqtt = self.server.mqtt_controllers[0]
+        self.mutables = [inst for inst in self.server.instances.values() if inst.identifier.startswith('Mutable')]
+        self.protocol = SenseLinkProtocol(self.server.instances, None, self.server.latency)
+        self.protocol.connection_made(NullTransport())
+        self.websocket = NullWebsocket()
+        self.counts = {'hass': 0, 'mqtt': 0, 'mutable': 0, 'polls': 0, 'reconnects': 0}
+
+    async def hass_connect(self):
+        await self.hass.on_message(self.websocket, json.dumps({"type": "auth_ok"}))
+        states = {f'light.soak_{i}': {"s": "on", "a": {"brightness": 128}} for i in range(self.args.plugs)}
+        await self.hass.on_message(self.websocket, json.dumps(
+            {"id": self.hass.entities_rq_id, "type": "event", "event": {"a": states}}))
+
+    async def drive_ingest(self):
+        interval = 1 / self.args.rate
+        while True:
+            entity = random.randrange(self.args.plugs)
+            await self.hass.on_message(self.websocket, json.dumps(
+                {"id": self.hass.entities_rq_id, "type": "event", "event": {
+                    "c": {f"light.soak_{entity}": {"+": {"a": {"brightness": random.randrange(256)}}}}}}))
+            await self.mqtt.receive(f'soak/{random.randrange(self.args.plugs)}/power', str(random.random() * 100))
+            random.choice(self.mutables).data_source.power = random.random() * 10
+            self.counts['hass'] += 1
+            self.counts['mqtt'] += 1
+            self.counts['mutable'] += 1
+
+            if random.random() < self.args.reconnect_probability:
+                # Simulate a dropped and restored HASS connection
+                self.hass.connection_lost()
+                await self.hass_connect()
+                self.counts['reconnects'] += 1
+            await asyncio.sleep(interval)
+
+    async def drive_polls(self):
+        while True:
+            self.protocol.datagram_received(SENSE_QUERY, SENSE_ADDR)
+            self.counts['polls'] += 1
+            await asyncio.sleep(self.args.poll_interval)
+
+    async def run(self):
+        self.mqtt.build_listeners()
+        await self.hass_connect()
+        drivers = [asyncio.create_task(self.drive_ingest()), asyncio.create_task(self.drive_polls())]
+
+        # Let caches and lazy imports settle before taking the baseline
+        await asyncio.sleep(min(self.args.interval, self.args.duration / 4))
+        baseline = filtered_snapshot()
+        baseline_tasks = len(asyncio.all_tasks())
+        max_tasks = baseline_tasks
+        start = time.monotonic()
+        failures = []
+        # Stay defined when the duration ends before the first check
+        growth = []
+        total_growth = 0
+
+        while time.monotonic() - start < self.args.duration:
+            await asyncio.sleep(min(self.args.interval, self.args.duration))
+            snapshot = filtered_snapshot()
+            growth = [stat for stat in snapshot.compare_to(baseline, 'lineno') if stat.size_diff > 0]
+            total_growth = sum(stat.size_diff for stat in growth)
+            task_count = len(asyncio.all_tasks())
+            max_tasks = max(max_tasks, task_count)
+
+            elapsed = time.monotonic() - start
+            logging.info(f"[{elapsed:.0f}s] {self.counts}, tasks: {task_count}, "
+                         f"growth since baseline: {total_growth / 1024:.1f} KiB")
+            for stat in growth[:self.args.top]:
+                logging.info(f"    {stat}")
+
+            if task_count > baseline_tasks + self.args.max_task_growth:
+                failures.append(f"Task count grew from {baseline_tasks} to {task_count}")
+                break
+
+        for driver in drivers:
+            driver.cancel()
+
+        if total_growth > self.args.max_growth_kb * 1024:
+            failures.append(f"Memory grew by {total_growth / 1024:.1f} KiB "
+                            f"(limit {self.args.max_growth_kb} KiB)")
+        print(f"Soak finished after {time.monotonic() - start:.0f}s: {self.counts}, max tasks: {max_tasks}")
+        print(f"Top growing allocation sites:")
+        for stat in growth[:self.args.top]:
+            print(f"    {stat}")
+        for failure in failures:
+            print(f"FAILED: {failure}")
+        return not failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", help="soak duration (seconds)", type=float, default=3600)
+    parser.add_argument("--interval", help="snapshot interval (seconds)", type=float, default=60)
+    parser.add_argument("--plugs", help="number of plugs of each type", type=int, default=50)
+    parser.add_argument("--rate", help="ingest updates per second, per source type", type=float, default=200)
+    parser.add_argument("--poll-interval", help="Sense poll interval (seconds)", type=float, default=1.0)
+    parser.add_argument("--reconnect-probability", help="chance of a simulated HASS reconnect per update",
+                        type=float, default=0.001)
+    parser.add_argument("--top", help="number of growing allocation sites to report", type=int, default=10)
+    parser.add_argument("--max-growth-kb", help="maximum allowed memory growth (KiB)", type=float, default=512)
+    parser.add_argument("--max-task-growth", help="maximum allowed growth in asyncio tasks", type=int, default=5)
+    parser.add_argument("-l", "--log", help="specify log level (DEBUG, INFO, etc)", default='INFO')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log.upper())
+    # Keep per-update SenseLink logging out of the soak output
+    logging.getLogger().handlers[0].addFilter(lambda record: record.module == 'soak' or record.levelno >= logging.WARNING)
+
+    tracemalloc.start()
+    passed = asyncio.run(Soak(args).run())
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,42 @@
+# Copyright 2022, Charles Powell
+#
+# Check that the streaming Home Assistant bulk state parse finds the same states as a full JSON parse,
+# including when states are nested inside other states' attributes
+#
+# Usage, from the repository root:
+# PYTHONPATH=. python benchmarks/stream_check.py
+# Exits with a non-zero status if any result differs.
+
+import json
+import sys
+
+from senselink.homeassistant.ha_stream import iter_tracked_states
+
+NESTED = {"entity_id": "sensor.a", "state": "999", "last_changed": "", "context": {}}
+STATES = [
+    {"entity_id": "sensor.group", "state": "on", "attributes": {"members": [NESTED], "note": "{\"[\\\""}},
+    {"entity_id": "sensor.a", "state": "42.5", "attributes": {"friendly_name": "A [1]"}},
+    {"entity_id": "sensor.b", "state": "1", "attributes": {"nested": {"entity_id": "sensor.c", "state": "9"}}},
+    {"entity_id": "sensor.c", "state": "7", "attributes": {}},
+    {"state": "3", "entity_id": "sensor.d", "attributes": {}},
+]
+TRACKED = {"sensor.a", "sensor.c", "sensor.d"}
+
+
+def check(separators):
+    # Returns True if the streaming parse matches a full parse, for frames encoded with these separators
+    frame = json.dumps({"id": 5, "type": "result", "success": True, "result": STATES}, separators=separators)
+    expected = [state for state in json.loads(frame)['result'] if state.get('entity_id') in TRACKED]
+    streamed = [state for state in iter_tracked_states(frame, TRACKED, pause_every=1) if state is not None]
+    if streamed != expected:
+        print(f"Mismatch with separators {separators}:\n  streamed: {streamed}\n  expected: {expected}")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    failed = [separators for separators in ((',', ':'), (', ', ': ')) if not check(separators)]
+    if failed:
+        print(f"FAILED: streaming parse differs from full parse for {len(failed)} frame encoding(s)")
+        sys.exit(1)
+    print("Streaming parse matches full parse")
@@ -11,10 +11,12 @@ root.setLevel(logging.DEBUG)
 handler = logging.StreamHandler(sys.stdout)
 
 
-async def change_mutable_plug_power(plug):
+async def change_mutable_plug_power(controller):
     while True:
         power = random.randrange(2, 15, 1)
-        plug.data_source.power = power
+        # Plugs can be specified by identifier or MAC, and any number of plugs can be updated at once.
+        # From other (non-asyncio) threads, use controller.update_powers_threadsafe() instead.
+        controller.update_powers({"mutable1": power})
         logging.info(f"Changed power to {power}")
         await asyncio.sleep(random.randrange(1, 4, 1))
 
@@ -37,9 +39,8 @@ async def main():
     # Create instances
     controller.create_instances()
 
-    # Get Mutable controller object, and create task to update it
-    mutable_plug = controller.plug_for_mac("50:c7:bf:f6:4f:39")
-    plug_update = change_mutable_plug_power(mutable_plug)
+    # Create task to update the Mutable plug
+    plug_update = change_mutable_plug_power(controller)
 
     # Get base SenseLink tasks (for other controllers in the config, perhaps), and
     # add our new top level plug task, as well as the main SenseLink controller itself
@@ -1,3 +1,3 @@
 from .senselink import SenseLink
 from .plug_instance import PlugInstance
-from .data_source import DataSource, MutableSource, AggregateSource
+from .data_source import DataSource, MutableSource, AggregateSource, DerivedSource
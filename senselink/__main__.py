@@ -3,12 +3,17 @@ import asyncio
 import os
 import argparse
 from senselink import SenseLink
+from senselink.common import use_event_loop
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config", help="specify config file path")
     parser.add_argument("-l", "--log", help="specify log level (DEBUG, INFO, etc)")
     parser.add_argument("-q", "--quiet", help="do not respond to Sense UPD queries", action="store_true")
+    parser.add_argument("--loop", help="event loop implementation to use (asyncio, uvloop)")
+    parser.add_argument("--record", help="record ingest and Sense traffic to the specified file")
+    parser.add_argument("--replay", help="replay traffic from the specified recording file, then exit")
+    parser.add_argument("--replay-speed", help="replay speed multiplier (0 for max speed)", type=float, default=1.0)
     args = parser.parse_args()
     config_path = args.config or '/etc/senselink/config.yml'
     loglevel = args.log or 'WARNING'
@@ -29,9 +34,24 @@ if __name__ == "__main__":
     # Create instances
     server.create_instances()
 
+    # Select event loop, preferring the command line option over the config
+    loop_name = use_event_loop(args.loop or server.event_loop)
+    logging.info(f"Using {loop_name} event loop")
+
+    if args.replay:
+        # Replay recorded traffic instead of connecting to anything
+        logging.info(f"Replaying traffic from {args.replay}")
+        asyncio.run(server.replay_traffic(args.replay, args.replay_speed))
+        exit(0)
+
+    if args.record:
+        server.record_traffic(args.record)
+
     # Start and run indefinitely
     logging.info("Starting SenseLink controller")
     try:
         asyncio.run(server.start())
     except KeyboardInterrupt:
         logging.info("Interrupt received, stopping SenseLink")
+    finally:
+        server.stop_recording()
@@ -0,0 +1,73 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import logging
+
+# Number of entries included in the periodic summary log
+SUMMARY_TOP = 10
+
+# Table entry fields: calls and time [seconds], cumulative, in the current window, and in the last full window
+CALLS, TOTAL, WINDOW_CALLS, WINDOW_TOTAL, ROLLING_CALLS, ROLLING_TOTAL = range(6)
+
+
+class TimeAccounting:
+    # Time spent on the event loop by each part of SenseLink (Sense responses, each controller, and each plug's
+    # data source handlers), measured around dispatch points with time.perf_counter(). Controller totals
+    # include the time of the data source handlers they call. Rolling totals cover the last full window.
+    def __init__(self, window=60.0, log_interval=None):
+        self.window = window
+        self.log_interval = log_interval
+        self.table = {}
+        self.windows = 0
+
+    def register(self, key):
+        # Table entries are created up front for known keys, so recording is only an update
+        entry = self.table.get(key)
+        if entry is None:
+            entry = self.table[key] = [0, 0.0, 0, 0.0, 0, 0.0]
+        return entry
+
+    def add(self, key, elapsed):
+        entry = self.table.get(key)
+        if entry is None:
+            entry = self.register(key)
+        entry[CALLS] += 1
+        entry[TOTAL] += elapsed
+        entry[WINDOW_CALLS] += 1
+        entry[WINDOW_TOTAL] += elapsed
+
+    def roll(self):
+        # Close the current window
+        for entry in self.table.values():
+            entry[ROLLING_CALLS] = entry[WINDOW_CALLS]
+            entry[ROLLING_TOTAL] = entry[WINDOW_TOTAL]
+            entry[WINDOW_CALLS] = 0
+            entry[WINDOW_TOTAL] = 0.0
+        self.windows += 1
+
+    async def run(self):
+        elapsed = 0.0
+        while True:
+            await asyncio.sleep(self.window)
+            self.roll()
+            elapsed += self.window
+            if self.log_interval is not None and elapsed >= self.log_interval:
+                elapsed = 0.0
+                self.log_summary()
+
+    def log_summary(self):
+        entries = sorted(self.table.items(), key=lambda item: item[1][ROLLING_TOTAL], reverse=True)
+        busy = sum(entry[ROLLING_TOTAL] for key, entry in entries if not key.startswith('plug '))
+        lines = [f"    {key}: {entry[ROLLING_TOTAL] * 1000:.1f}ms over {entry[ROLLING_CALLS]} calls "
+                 f"({entry[ROLLING_TOTAL] / self.window * 100:.2f}% of loop)"
+                 for key, entry in entries[:SUMMARY_TOP] if entry[ROLLING_CALLS]]
+        logging.info(f"Event loop time over the last {self.window:g}s: {busy * 1000:.1f}ms"
+                     + (":\n" + "\n".join(lines) if lines else ""))
+
+    def stats(self):
+        return {key: {
+            'calls': entry[CALLS],
+            'total': entry[TOTAL],
+            'rolling_calls': entry[ROLLING_CALLS],
+            'rolling_total': entry[ROLLING_TOTAL],
+            'rolling_fraction': entry[ROLLING_TOTAL] / self.window,
+        } for key, entry in self.table.items()}
@@ -1,6 +1,7 @@
 # Copyright 2022, Charles Powell
 import dpath.util
 import logging
+import asyncio
 
 
 # Check if a multi-layer key exists
@@ -37,3 +38,19 @@ def get_float_at_path(message, path, default_value=None):
         value = default_value
 
     return value
+
+
+def use_event_loop(name=None):
+    # Select the event loop implementation used by asyncio.run(), returning the name of the one selected
+    if name is None or name.lower() == 'asyncio':
+        return 'asyncio'
+    if name.lower() != 'uvloop':
+        logging.warning(f'Unknown event loop "{name}", using default asyncio event loop')
+        return 'asyncio'
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning('uvloop is not installed, using default asyncio event loop')
+        return 'asyncio'
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return 'uvloop'
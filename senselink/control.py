@@ -0,0 +1,127 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import json
+import logging
+import os
+import time
+
+from .data_source import MutableSource
+
+# Maximum request line length [bytes]
+LINE_LIMIT = 2 ** 20
+# Write buffer size before waiting for the client to read responses [bytes]
+DRAIN_THRESHOLD = 2 ** 16
+
+
+class ControlServer:
+    # Line-based control server for updating Mutable plugs from other processes. Each request line
+    # gets exactly one response line, so requests can be pipelined. Request lines are either:
+    #   - One or more 'identifier=watts' pairs, separated by spaces or commas
+    #   - A JSON object of identifier to watts, or a JSON array of [identifier, watts] pairs
+    #   - 'GET', optionally followed by plug identifiers, to return current plug states as JSON
+    # Updates respond with 'OK <number of plugs updated>', and errors with 'ERR <reason>'.
+    # Plugs can be specified by identifier or MAC address.
+
+    def __init__(self, senselink, socket_path=None, host='127.0.0.1', port=None):
+        self.senselink = senselink
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.server = None
+        self.request_count = 0
+
+    async def start(self):
+        if self.socket_path is not None:
+            if os.path.exists(self.socket_path):
+                # Remove stale socket from prior run
+                os.unlink(self.socket_path)
+            self.server = await asyncio.start_unix_server(self.handle_client, self.socket_path, limit=LINE_LIMIT)
+            logging.info(f"Control server listening on {self.socket_path}")
+        else:
+            self.server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=LINE_LIMIT)
+            logging.info(f"Control server listening on {self.host}:{self.port}")
+
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            if self.socket_path is not None and os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(b'ERR request line too long\n')
+                    break
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                start = time.perf_counter()
+                writer.write(self.handle_line(line) + b'\n')
+                if self.senselink.accounting is not None:
+                    self.senselink.accounting.add('control', time.perf_counter() - start)
+                # Only wait on the client when responses are backing up, so pipelined requests aren't slowed
+                if writer.transport.get_write_buffer_size() > DRAIN_THRESHOLD:
+                    await writer.drain()
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def handle_line(self, line):
+        self.request_count += 1
+        try:
+            if line[:1] in (b'{', b'['):
+                updates = self.parse_json(line)
+            elif line[:3].upper() == b'GET':
+                identifiers = line[3:].decode().split()
+                return json.dumps(self.plug_states(identifiers), separators=(',', ':')).encode()
+            else:
+                updates = self.parse_pairs(line)
+        except (ValueError, TypeError, UnicodeDecodeError) as err:
+            return f'ERR {err}'.encode()
+
+        updated = self.senselink.update_powers(updates)
+        return f'OK {updated}'.encode()
+
+    @staticmethod
+    def parse_json(line):
+        data = json.loads(line)
+        if isinstance(data, dict):
+            items = data.items()
+        else:
+            items = data
+        return {str(key): float(value) for key, value in items}
+
+    @staticmethod
+    def parse_pairs(line):
+        updates = {}
+        for pair in line.replace(b',', b' ').split():
+            key, sep, value = pair.partition(b'=')
+            if not sep:
+                raise ValueError(f"expected identifier=watts, got '{pair.decode()}'")
+            updates[key.decode()] = float(value.decode())
+        return updates
+
+    def plug_states(self, identifiers=None):
+        if identifiers:
+            instances = []
+            for key in identifiers:
+                inst = self.senselink.plug(key)
+                if inst is None:
+                    raise ValueError(f"no plug found for '{key}'")
+                instances.append(inst)
+        else:
+            instances = self.senselink.instances.values()
+        return {inst.identifier: {
+            'mac': inst.mac,
+            'power': inst.power,
+            'mutable': isinstance(inst.data_source, MutableSource),
+            'in_aggregate': inst.in_aggregate,
+        } for inst in instances}
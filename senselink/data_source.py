@@ -1,4 +1,7 @@
 # Copyright 2022, Charles Powell
+import logging
+
+from .formula import Formula, FormulaError
 
 class DataSource:
     _power = None
@@ -10,6 +13,10 @@ class DataSource:
     max_watts = 0.0
     on_fraction = 1.0
     controller = None
+    # Callbacks for power changes, see add_observer()
+    observers = ()
+    # Power last notified to observers, for sources computed from other sources
+    _observed_power = None
 
     def __init__(self, identifier, details, controller=None):
         self.identifier = identifier
@@ -40,7 +47,48 @@ class DataSource:
 
     @power.setter
     def power(self, new_power):
+        self.set_power(new_power)
+
+    def set_power(self, new_power):
+        # Set power, notifying observers if it changed
+        if not self.observers:
+            self._power = new_power
+            return
+        old_power = self._power if self._power is not None else self.power
         self._power = new_power
+        if new_power != old_power:
+            self.notify(old_power, new_power)
+
+    def add_observer(self, callback):
+        # Call callback(source, old_power, new_power) whenever power changes. Sources computed from other
+        # sources only observe their inputs while they are observed themselves.
+        if not self.observers:
+            inputs = self.input_sources()
+            if inputs:
+                self._observed_power = self.power
+                for ds in inputs:
+                    ds.add_observer(self.input_changed)
+        self.observers = self.observers + (callback,)
+
+    def remove_observer(self, callback):
+        self.observers = tuple(cb for cb in self.observers if cb != callback)
+        if not self.observers:
+            for ds in self.input_sources():
+                ds.remove_observer(self.input_changed)
+
+    def notify(self, old_power, new_power):
+        for callback in self.observers:
+            callback(self, old_power, new_power)
+
+    def input_sources(self):
+        # Data sources that this source's power is computed from
+        return ()
+
+    def input_changed(self, source, old_power, new_power):
+        power = self.power
+        old_power, self._observed_power = self._observed_power, power
+        if power != old_power:
+            self.notify(old_power, power)
 
     @property
     def current(self):
@@ -92,6 +140,54 @@ class AggregateSource(DataSource):
         sum_power = sum(plug_powers)
         return sum_power
 
+    def input_sources(self):
+        return [plug.data_source for plug in self.elements]
+
+
+class DerivedSource(DataSource):
+
+    def __init__(self, identifier, details, controller=None):
+        super().__init__(identifier, details, controller)
+
+        # (formula name, plug) pairs, resolved once all plugs are defined
+        self.inputs = ()
+        self._input_powers = None
+        self._value = 0.0
+        self.evaluations = 0
+
+        if details is not None:
+            formula = details.get('formula')
+            if formula is None:
+                raise AssertionError(f"Configuration Error: Derived plug {identifier} requires a formula")
+            try:
+                self.formula = Formula(formula)
+            except FormulaError as err:
+                raise AssertionError(f"Configuration Error: Derived plug {identifier}: {err}")
+            # Optional mapping of formula names to plug IDs, for plug IDs that aren't valid names
+            aliases = details.get('inputs') or {}
+            self.input_ids = {name: str(aliases.get(name, name)) for name in self.formula.names}
+
+    @property
+    def power(self):
+        # Only re-evaluate the formula when an input power has changed
+        powers = tuple(plug.power for _, plug in self.inputs)
+        if powers != self._input_powers:
+            self._input_powers = powers
+            self._value = self.evaluate(powers)
+        return self._value
+
+    def evaluate(self, powers):
+        self.evaluations += 1
+        values = {name: power for (name, _), power in zip(self.inputs, powers)}
+        try:
+            return float(self.formula.evaluate(values))
+        except (ZeroDivisionError, TypeError, ValueError) as err:
+            logging.warning(f"Error evaluating formula for Derived plug {self.identifier} ({err}), using 0W")
+            return 0.0
+
+    def input_sources(self):
+        return [plug.data_source for _, plug in self.inputs]
+
 
 if __name__ == "__main__":
     pass
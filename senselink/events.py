@@ -0,0 +1,65 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import time
+from collections import deque, namedtuple
+
+# Power change of a plug, from the last value delivered to the subscriber (for the first change, the plug's
+# power when subscribing)
+PowerChange = namedtuple('PowerChange', ['plug', 'old', 'new', 'timestamp'])
+
+
+class PowerSubscription:
+    # Async iterator of PowerChange events for a set of plugs, fed by data source observers. Changes smaller
+    # than the threshold (relative to the last value delivered for that plug) are skipped. If the subscriber
+    # falls behind, the oldest queued changes are dropped once max_queue are waiting.
+    # Must be created and consumed on the SenseLink event loop.
+    def __init__(self, plugs, threshold=0.0, max_queue=100):
+        self.threshold = threshold
+        # Data source to plug identifier
+        self.sources = {plug.data_source: plug.identifier for plug in plugs}
+        self._queue = deque(maxlen=max_queue)
+        self._event = asyncio.Event()
+        # Last value delivered for each data source, starting from the power when subscribing
+        self._last = {}
+        self.closed = False
+        self.dropped = 0
+
+        for ds in self.sources:
+            self._last[ds] = ds.power
+            ds.add_observer(self.power_changed)
+
+    def power_changed(self, source, old_power, new_power):
+        last = self._last.get(source)
+        if last is not None and new_power is not None and abs(new_power - last) < self.threshold:
+            return
+        self._last[source] = new_power
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(PowerChange(self.sources[source], last, new_power, time.time()))
+        self._event.set()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for ds in self.sources:
+            ds.remove_observer(self.power_changed)
+        # Wake the subscriber, to end iteration
+        self._event.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self._event.clear()
+            await self._event.wait()
+        return self._queue.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,204 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+FORMAT_INFLUX = 'influx'
+FORMAT_CSV = 'csv'
+MODE_BROADCAST = 'broadcast'
+MODE_CHANGE = 'change'
+
+CSV_HEADER = 'timestamp,plug,mac,power\n'
+# Maximum size of a single UDP export datagram [bytes]
+UDP_PAYLOAD_SIZE = 1400
+
+
+def escape_tag(value):
+    # Escape InfluxDB line protocol tag values
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+class PowerExporter:
+    # Samples reported plug power after each Sense request (or only changed values), and writes the samples
+    # in batches to a local file and/or a line protocol socket
+    accounting = None
+
+    def __init__(self, instances, path=None, fmt=FORMAT_INFLUX, mode=MODE_BROADCAST, flush_interval=10.0,
+                 max_bytes=10 * 2 ** 20, backups=3, target=None, measurement='senselink', max_buffer=100000):
+        self.instances = instances
+        self.path = path
+        self.format = fmt
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.target = urlparse(target) if target is not None else None
+        self.measurement = escape_tag(measurement)
+
+        self.loop = None
+        self._buffer = deque(maxlen=max_buffer)
+        self._last_powers = {}
+        self._sample_scheduled = False
+        self._file = None
+        self._udp_transport = None
+        self._tcp_writer = None
+
+        self.samples = 0
+        self.lines_written = 0
+        self.lines_dropped = 0
+
+    def notify_poll(self, threadsafe=False):
+        # Called for each Sense request, schedules sampling to happen after the response has been sent
+        if self.loop is None or self._sample_scheduled:
+            return
+        self._sample_scheduled = True
+        if threadsafe:
+            self.loop.call_soon_threadsafe(self.sample)
+        else:
+            self.loop.call_soon(self.sample)
+
+    def sample(self):
+        start = time.perf_counter()
+        self._sample_scheduled = False
+        self.samples += 1
+        timestamp = time.time()
+        for inst in self.instances.values():
+            if inst.in_aggregate:
+                # Not reported to Sense
+                continue
+            power = inst.power
+            if self.mode == MODE_CHANGE and self._last_powers.get(inst.identifier) == power:
+                continue
+            self._last_powers[inst.identifier] = power
+            if len(self._buffer) == self._buffer.maxlen:
+                self.lines_dropped += 1
+            self._buffer.append(self.format_line(timestamp, inst, power))
+        if self.accounting is not None:
+            self.accounting.add('export', time.perf_counter() - start)
+
+    def format_line(self, timestamp, inst, power):
+        if self.format == FORMAT_CSV:
+            return f'{timestamp:.3f},{inst.identifier},{inst.mac},{power}\n'
+        return (f'{self.measurement},plug={escape_tag(inst.identifier)},mac={escape_tag(inst.mac)} '
+                f'power={float(power)} {int(timestamp * 1e9)}\n')
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        logging.info(f"Exporting plug power to {self.path or ''} {self.target.geturl() if self.target else ''}")
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            await self.flush()
+            self.close()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        lines = list(self._buffer)
+        self._buffer.clear()
+        written = len(lines)
+        if self.path is not None:
+            try:
+                # Avoid blocking the event loop with file I/O
+                await self.loop.run_in_executor(None, self.write_file, lines)
+            except OSError as err:
+                logging.error(f"Unable to write power export to {self.path} ({err}), dropping batch")
+                self.lines_dropped += len(lines)
+                written = 0
+                # Reopen on the next flush
+                self.close_file()
+        if self.target is not None:
+            await self.send(lines)
+        self.lines_written += written
+
+    def write_file(self, lines):
+        if self._file is None:
+            self.open_file()
+        self._file.writelines(lines)
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def open_file(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a')
+        if new_file and self.format == FORMAT_CSV:
+            self._file.write(CSV_HEADER)
+
+    def rotate(self):
+        self._file.close()
+        self._file = None
+        for index in range(self.backups - 1, 0, -1):
+            older = f'{self.path}.{index}'
+            if os.path.exists(older):
+                os.replace(older, f'{self.path}.{index + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        logging.info(f"Rotated power export file {self.path}")
+
+    async def send(self, lines):
+        try:
+            if self.target.scheme == 'udp':
+                await self.send_udp(lines)
+            elif self.target.scheme == 'tcp':
+                await self.send_tcp(lines)
+            else:
+                logging.error(f"Unsupported export target scheme '{self.target.scheme}', use udp:// or tcp://")
+                self.target = None
+        except OSError as err:
+            logging.warning(f"Unable to send power export to {self.target.geturl()} ({err}), dropping batch")
+            self.lines_dropped += len(lines)
+            self._tcp_writer = None
+
+    async def send_udp(self, lines):
+        if self._udp_transport is None:
+            self._udp_transport, _ = await self.loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=(self.target.hostname, self.target.port))
+        # Pack lines into datagrams
+        datagram = b''
+        for line in lines:
+            encoded = line.encode()
+            if datagram and len(datagram) + len(encoded) > UDP_PAYLOAD_SIZE:
+                self._udp_transport.sendto(datagram)
+                datagram = b''
+            datagram += encoded
+        if datagram:
+            self._udp_transport.sendto(datagram)
+
+    async def send_tcp(self, lines):
+        if self._tcp_writer is None or self._tcp_writer.is_closing():
+            _, self._tcp_writer = await asyncio.open_connection(self.target.hostname, self.target.port)
+        self._tcp_writer.write(''.join(lines).encode())
+        await self._tcp_writer.drain()
+
+    def close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def close(self):
+        self.close_file()
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+            self._udp_transport = None
+        if self._tcp_writer is not None:
+            self._tcp_writer.close()
+            self._tcp_writer = None
+
+    def stats(self):
+        return {
+            'samples': self.samples,
+            'buffered': len(self._buffer),
+            'written': self.lines_written,
+            'dropped': self.lines_dropped,
+        }
@@ -0,0 +1,116 @@
+# Copyright 2022, Charles Powell
+import ast
+
+
+def clamp(value, low, high):
+    return min(max(value, low), high)
+
+
+# Functions available to formulas. sum() takes its values as separate arguments.
+FUNCTIONS = {
+    'min': min,
+    'max': max,
+    'abs': abs,
+    'sum': lambda *values: sum(values),
+    'clamp': clamp,
+}
+# Number of arguments (minimum, maximum) for each function, None for no maximum
+ARITY = {
+    'min': (2, None),
+    'max': (2, None),
+    'abs': (1, 1),
+    'sum': (1, None),
+    'clamp': (3, 3),
+}
+
+BINARY_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div)
+UNARY_OPERATORS = (ast.UAdd, ast.USub)
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def validate(node, names):
+    # Walk the expression tree, allowing only arithmetic on numbers, plug names, and whitelisted functions.
+    # Referenced plug names are added to the names set.
+    if isinstance(node, ast.Expression):
+        validate(node.body, names)
+    elif isinstance(node, ast.BinOp):
+        if not isinstance(node.op, BINARY_OPERATORS):
+            raise FormulaError(f"operator {type(node.op).__name__} not allowed")
+        validate(node.left, names)
+        validate(node.right, names)
+    elif isinstance(node, ast.UnaryOp):
+        if not isinstance(node.op, UNARY_OPERATORS):
+            raise FormulaError(f"operator {type(node.op).__name__} not allowed")
+        validate(node.operand, names)
+    elif isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise FormulaError(f"constant {node.value!r} is not a number")
+    elif isinstance(node, ast.Name):
+        if node.id in FUNCTIONS:
+            raise FormulaError(f"function {node.id} must be called")
+        names.add(node.id)
+    elif isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise FormulaError(f"only {', '.join(FUNCTIONS)} functions can be called")
+        if node.keywords:
+            raise FormulaError(f"keyword arguments not allowed")
+        low, high = ARITY[node.func.id]
+        if len(node.args) < low or (high is not None and len(node.args) > high):
+            expected = f"{low}" if low == high else f"at least {low}"
+            raise FormulaError(f"{node.func.id}() takes {expected} argument(s), got {len(node.args)}")
+        for arg in node.args:
+            validate(arg, names)
+    else:
+        raise FormulaError(f"{type(node).__name__} expressions not allowed")
+
+
+class Formula:
+    # Restricted arithmetic expression over plug powers, parsed and compiled once
+    def __init__(self, expression):
+        self.expression = str(expression)
+        try:
+            tree = ast.parse(self.expression.strip(), mode='eval')
+        except SyntaxError as err:
+            raise FormulaError(f"invalid formula '{self.expression}': {err.msg}")
+        names = set()
+        validate(tree, names)
+        self.names = sorted(names)
+        self._code = compile(tree, '<formula>', 'eval')
+
+    def evaluate(self, values):
+        # Evaluate with a dict of name to value
+        scope = dict(FUNCTIONS)
+        scope.update(values)
+        return eval(self._code, {'__builtins__': {}}, scope)
+
+
+def find_cycle(graph):
+    # Return a list of nodes forming a dependency cycle in the graph (dict of node to dependencies), or None
+    visited = set()
+    path = []
+    on_path = set()
+
+    def visit(node):
+        if node in on_path:
+            return path[path.index(node):] + [node]
+        if node in visited or node not in graph:
+            return None
+        visited.add(node)
+        path.append(node)
+        on_path.add(node)
+        for dependency in graph[node]:
+            cycle = visit(dependency)
+            if cycle is not None:
+                return cycle
+        path.pop()
+        on_path.discard(node)
+        return None
+
+    for start in graph:
+        cycle = visit(start)
+        if cycle is not None:
+            return cycle
+    return None
@@ -1,20 +1,52 @@
 import asyncio
+import random
+import time
 import websockets
 import json
-from socket import gaierror
 from senselink.common import *
+from .ha_stream import frame_id, iter_tracked_states
 
 
 class HAController:
     ws = None
-    event_rq_id = 1
-    bulk_rq_id = 2
-    data_sources = []
+    event_rq_id = None
+    bulk_rq_id = None
+    entities_rq_id = None
+    recorder = None
+    accounting = None
 
-    def __init__(self, url, auth_token, max_ws_message_size=None):
+    def __init__(self, url, auth_token, max_ws_message_size=None, entity_subscription=True,
+                 reconnect_min=2.0, reconnect_max=300.0, stale_timeout=None, streaming_parse=False):
         self.url = url
         self.auth_token = auth_token
         self.max_ws_message = max_ws_message_size
+        # Use the entity-scoped subscription where supported by the server
+        self.entity_subscription = entity_subscription
+        # Walk bulk get_states results incrementally, only decoding tracked entities
+        self.streaming_parse = streaming_parse
+        # Reconnection backoff bounds [seconds]
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        # Time without a connection before plugs are marked stale [seconds], None to keep values indefinitely
+        self.stale_timeout = stale_timeout
+
+        # Connection statistics
+        self.connect_count = 0
+        self.disconnect_count = 0
+        self.last_outage_duration = None
+        self.total_outage_duration = 0.0
+        self._outage_start = None
+        self._failures = 0
+        self._stale_timer = None
+
+        self.data_sources = []
+        # Map of entity_id to data sources tracking that entity
+        self.entity_index = {}
+        # Latest (uncompressed) state for each tracked entity, when using subscribe_entities
+        self.entity_states = {}
+        self._rq_id = 0
+        # Subscription updates for data sources added while connected
+        self._subscribe_tasks = set()
 
     async def connect(self):
         # Create task
@@ -22,80 +54,264 @@ class HAController:
 
     async def client_handler(self):
         logging.info(f"Starting websocket client to URL: {self.url}")
-        try:
-            if self.max_ws_message is not None:
-                max_ws_param = int(self.max_ws_message)
-                if max_ws_param > 0:
-                    ws_args = {"uri": self.url, "max_size": max_ws_param}
-                else:
-                    # Interpret 0 as None/No limit
-                    ws_args = ws_args = {"uri": self.url, "max_size": None}
+        if self.max_ws_message is not None:
+            max_ws_param = int(self.max_ws_message)
+            if max_ws_param > 0:
+                ws_args = {"uri": self.url, "max_size": max_ws_param}
             else:
-                ws_args = {"uri": self.url}
+                # Interpret 0 as None/No limit
+                ws_args = {"uri": self.url, "max_size": None}
+        else:
+            ws_args = {"uri": self.url}
 
-            async with websockets.connect(**ws_args) as websocket:
-                self.ws = websocket
-                # Wait for incoming message from server
-                while True:
-                    try:
+        # Single supervised connection loop, reconnecting with backoff
+        while True:
+            try:
+                async with websockets.connect(**ws_args) as websocket:
+                    self.ws = websocket
+                    # Wait for incoming message from server
+                    while True:
                         message = await websocket.recv()
+                        if self.recorder is not None:
+                            self.recorder.record_hass(self.url, message)
                         logging.debug(f"Received message: {message}")
                         await self.on_message(websocket, message)
-                    except websockets.exceptions.ConnectionClosed as err:
-                        logging.error(f"Lost connection to websocket server ({err})")
-                        logging.info(f"Reconnecting in 10...")
-                        await asyncio.sleep(10)
-                        asyncio.create_task(self.client_handler())
-                        return False
-        except (websockets.exceptions.WebSocketException, asyncio.exceptions.TimeoutError, gaierror) as err:
-            logging.error(f"Unable to connect to server at {self.url} ({type(err)}:{err})")
-            logging.info(f"Attempting to reconnect in 10...")
-            await asyncio.sleep(10)
-            asyncio.create_task(self.client_handler())
+            except websockets.exceptions.ConnectionClosed as err:
+                logging.error(f"Lost connection to websocket server ({err})")
+            # OSError covers refused connections and DNS (gaierror) failures
+            except (websockets.exceptions.WebSocketException, asyncio.exceptions.TimeoutError, OSError) as err:
+                logging.error(f"Unable to connect to server at {self.url} ({type(err)}:{err})")
+            # Errors handling a message (e.g. a bad plug configuration) must not end the client, so reconnect
+            # with backoff like any other failure
+            except Exception as err:
+                logging.exception(f"Error handling Home Assistant connection ({type(err)}:{err})")
+
+            self.ws = None
+            self.event_rq_id = None
+            self.bulk_rq_id = None
+            self.entities_rq_id = None
+            self.connection_lost()
+            delay = self.reconnect_delay()
+            logging.info(f"Reconnecting in {round(delay, 1)}...")
+            await asyncio.sleep(delay)
+
+    def reconnect_delay(self):
+        # Exponential backoff, with jitter to avoid synchronized reconnects
+        delay = min(self.reconnect_max, self.reconnect_min * 2 ** self._failures)
+        self._failures += 1
+        return random.uniform(delay / 2, delay)
+
+    def connection_lost(self):
+        if self._outage_start is not None:
+            # Already in an outage (i.e. a failed reconnection attempt)
+            return
+        self.disconnect_count += 1
+        self._outage_start = time.monotonic()
+        if self.stale_timeout is not None:
+            loop = asyncio.get_running_loop()
+            self._stale_timer = loop.call_later(self.stale_timeout, self.mark_stale)
+
+    def connection_restored(self):
+        self.connect_count += 1
+        self._failures = 0
+        if self._stale_timer is not None:
+            self._stale_timer.cancel()
+            self._stale_timer = None
+        if self._outage_start is not None:
+            self.last_outage_duration = time.monotonic() - self._outage_start
+            self.total_outage_duration += self.last_outage_duration
+            self._outage_start = None
+            logging.info(f"Reconnected to {self.url} after {round(self.last_outage_duration, 1)}s")
+
+    def mark_stale(self):
+        self._stale_timer = None
+        logging.warning(f"No connection to {self.url} for {self.stale_timeout}s, marking plugs as stale")
+        for ds in self.data_sources:
+            ds.mark_stale()
+
+    def stats(self):
+        outage = None
+        if self._outage_start is not None:
+            outage = time.monotonic() - self._outage_start
+        return {
+            'connected': self.ws is not None and self._outage_start is None,
+            'connects': self.connect_count,
+            'reconnects': max(self.connect_count - 1, 0),
+            'disconnects': self.disconnect_count,
+            'current_outage': outage,
+            'last_outage': self.last_outage_duration,
+            'total_outage': self.total_outage_duration,
+        }
+
+    def next_id(self):
+        # HASS requires message IDs to increase within a connection
+        self._rq_id += 1
+        return self._rq_id
+
+    def build_entity_index(self):
+        self.entity_index = {}
+        for ds in self.data_sources:
+            if ds.entity_id is None:
+                continue
+            self.entity_index.setdefault(ds.entity_id, []).append(ds)
+        return self.entity_index
+
+    def add_source(self, ds):
+        # Route entity updates to a data source added at runtime, updating the subscription if connected
+        if ds not in self.data_sources:
+            self.data_sources.append(ds)
+        if ds.entity_id is None:
+            return
+        sources = self.entity_index.setdefault(ds.entity_id, [])
+        if ds in sources:
+            return
+        new_entity = not sources
+        sources.append(ds)
+
+        if self.ws is None or (self.entities_rq_id is None and self.event_rq_id is None):
+            # Not subscribed yet, the entity is included when subscribing
+            return
+        if self.entities_rq_id is not None and not new_entity:
+            # Already subscribed to this entity, use its latest state
+            status = self.entity_states.get(ds.entity_id)
+            if status is not None:
+                self.update_source(ds, ds.parse_bulk_update, status)
+            return
+        task = asyncio.get_running_loop().create_task(self.resubscribe(self.ws))
+        self._subscribe_tasks.add(task)
+        task.add_done_callback(self._subscribe_tasks.discard)
+
+    def remove_source(self, ds):
+        # Stop routing entity updates to the data source
+        if ds in self.data_sources:
+            self.data_sources.remove(ds)
+        sources = self.entity_index.get(ds.entity_id)
+        if sources is not None and ds in sources:
+            sources.remove(ds)
+
+    async def resubscribe(self, ws):
+        try:
+            if self.entities_rq_id is not None:
+                # Replace the entity subscription with one including new entities, which sends their states
+                unsubscribe_command = {
+                    "id": self.next_id(),
+                    "type": "unsubscribe_events",
+                    "subscription": self.entities_rq_id
+                }
+                await ws.send(json.dumps(unsubscribe_command))
+                await self.subscribe_entities(ws)
+            else:
+                # Already receiving all state changes, only current states are needed
+                await self.request_states(ws)
+        except websockets.exceptions.WebSocketException as err:
+            # Subscribed again with all entities on reconnect
+            logging.error(f"Unable to update subscription on {self.url} ({err})")
+
+    async def subscribe_entities(self, ws):
+        # Only receive updates for the entities we are tracking
+        self.entities_rq_id = self.next_id()
+        entities_command = {
+            "id": self.entities_rq_id,
+            "type": "subscribe_entities",
+            "entity_ids": list(self.entity_index.keys())
+        }
+        await ws.send(json.dumps(entities_command))
+        logging.info(f"Entity subscription request sent for {len(self.entity_index)} entities")
+
+    async def subscribe_all(self, ws):
+        # Send subscription command
+        self.event_rq_id = self.next_id()
+        events_command = {
+            "id": self.event_rq_id,
+            "type": "subscribe_events",
+            "event_type": "state_changed"
+        }
+        await ws.send(json.dumps(events_command))
+        logging.info("Event update request sent")
+
+        # Request full status update to get current value
+        await self.request_states(ws)
+
+    async def request_states(self, ws):
+        self.bulk_rq_id = self.next_id()
+        events_command = {
+            "id": self.bulk_rq_id,
+            "type": "get_states",
+        }
+        await ws.send(json.dumps(events_command))
+        logging.info("All states request sent")
 
     async def on_message(self, ws, message):
+        if self.streaming_parse and self.bulk_rq_id is not None and frame_id(message) == self.bulk_rq_id:
+            # Large bulk update, avoid decoding the entire frame
+            await self.parse_bulk_stream(message)
+            return
+
+        if self.accounting is None:
+            await self.handle_message(ws, message)
+            return
+        start = time.perf_counter()
+        try:
+            await self.handle_message(ws, message)
+        finally:
+            self.accounting.add(f'hass {self.url}', time.perf_counter() - start)
+
+    async def handle_message(self, ws, message):
         # Authentication with HASS Websockets
         message = json.loads(message)
+        message_type = message.get('type')
+        message_id = message.get('id')
 
-        if 'type' in message and message['type'] == 'auth_required':
+        if message_type == 'auth_required':
             logging.info("Authentication requested")
             auth_response = {'type': 'auth', 'access_token': self.auth_token}
             await ws.send(json.dumps(auth_response))
 
-        elif 'type' in message and message['type'] == "auth_invalid":
+        elif message_type == "auth_invalid":
             logging.error("Authentication failed")
 
-        elif 'type' in message and message['type'] == "auth_ok":
+        elif message_type == "auth_ok":
             logging.info("Authentication successful")
-            # Authentication successful
-            # Send subscription command
-            events_command = {
-                "id": self.event_rq_id,
-                "type": "subscribe_events",
-                "event_type": "state_changed"
-            }
-            await ws.send(json.dumps(events_command))
-            logging.info("Event update request sent")
+            self.connection_restored()
+            # Authentication successful, message IDs start over for this connection
+            self._rq_id = 0
+            self.event_rq_id = None
+            self.bulk_rq_id = None
+            self.entities_rq_id = None
+            self.entity_states = {}
+            self.build_entity_index()
 
-            # Request full status update to get current value
-            events_command = {
-                "id": self.bulk_rq_id,
-                "type": "get_states",
-            }
-            await ws.send(json.dumps(events_command))
-            logging.info("All states request sent")
+            if self.entity_subscription:
+                await self.subscribe_entities(ws)
+            else:
+                await self.subscribe_all(ws)
 
-        elif 'type' in message and message['id'] == self.event_rq_id:
+        elif message_id is not None and message_id == self.entities_rq_id:
+            if message_type == 'result':
+                if not message.get('success'):
+                    # Likely an older HASS version without (filtered) subscribe_entities support
+                    logging.warning(f"Entity subscription not supported by server ({message.get('error')}), "
+                                    f"falling back to subscribing to all state changes")
+                    self.entities_rq_id = None
+                    await self.subscribe_all(ws)
+                return
+            # Compressed entity state updates
+            if not message.get('event'):
+                return
+            self.parse_entities_event(message['event'])
+
+        elif message_type is not None and message_id == self.event_rq_id:
             # Look for state_changed events
             logging.debug("Potential event update received")
             # Check for data
-            if not safekey(message, 'event/data'):
+            data = safekey(message, 'event/data')
+            if not data:
                 return
-            # Notify attached data sources
-            for ds in self.data_sources:
-                ds.parse_incremental_update(message['event']['data'])
+            # Notify data sources tracking this entity
+            for ds in self.entity_index.get(data.get('entity_id'), ()):
+                self.update_source(ds, ds.parse_incremental_update, data)
 
-        elif 'type' in message and message['id'] == self.bulk_rq_id:
+        elif message_type is not None and message_id == self.bulk_rq_id:
             # Look for state_changed events
             logging.info("Bulk update received")
             if message.get('result') is None:
@@ -105,8 +321,69 @@ class HAController:
             logging.debug(f"Entity update received: {bulk_update}")
             # Loop through statuses
             for status in bulk_update:
-                # Notify attached data sources
-                for ds in self.data_sources:
-                    ds.parse_bulk_update(status)
+                # Notify data sources tracking this entity
+                for ds in self.entity_index.get(status.get('entity_id'), ()):
+                    self.update_source(ds, ds.parse_bulk_update, status)
         else:
             logging.debug(f"Unknown/unhandled message received: {message}")
+
+    async def parse_bulk_stream(self, frame):
+        logging.info("Bulk update received, parsing tracked entities")
+        # Only account for time between yields, not time spent in other tasks
+        start = time.perf_counter()
+        for status in iter_tracked_states(frame, self.entity_index):
+            if status is None:
+                if self.accounting is not None:
+                    self.accounting.add(f'hass {self.url}', time.perf_counter() - start)
+                # Allow other tasks (i.e. Sense responses) to run
+                await asyncio.sleep(0)
+                start = time.perf_counter()
+                continue
+            for ds in self.entity_index[status['entity_id']]:
+                self.update_source(ds, ds.parse_bulk_update, status)
+        if self.accounting is not None:
+            self.accounting.add(f'hass {self.url}', time.perf_counter() - start)
+
+    def parse_entities_event(self, event):
+        # Full states, sent initially (and for newly added entities)
+        for entity_id, compressed in (event.get('a') or {}).items():
+            status = {
+                'entity_id': entity_id,
+                'state': compressed.get('s'),
+                'attributes': compressed.get('a') or {}
+            }
+            self.entity_states[entity_id] = status
+            self.notify_entity(entity_id, status)
+
+        # Changes to previously sent states
+        for entity_id, diff in (event.get('c') or {}).items():
+            status = self.entity_states.get(entity_id)
+            if status is None:
+                status = {'entity_id': entity_id, 'state': None, 'attributes': {}}
+                self.entity_states[entity_id] = status
+            additions = diff.get('+') or {}
+            if 's' in additions:
+                status['state'] = additions['s']
+            if 'a' in additions:
+                status['attributes'].update(additions['a'])
+            removals = diff.get('-') or {}
+            for key in removals.get('a') or []:
+                status['attributes'].pop(key, None)
+            self.notify_entity(entity_id, status)
+
+        # Removed entities
+        for entity_id in event.get('r') or []:
+            self.entity_states.pop(entity_id, None)
+
+    def notify_entity(self, entity_id, status):
+        for ds in self.entity_index.get(entity_id, ()):
+            self.update_source(ds, ds.parse_bulk_update, status)
+
+    def update_source(self, ds, update, status):
+        # Pass an entity update to a data source, accounting for the time taken if enabled
+        if self.accounting is None:
+            update(status)
+            return
+        start = time.perf_counter()
+        update(status)
+        self.accounting.add(f'plug {ds.identifier}', time.perf_counter() - start)
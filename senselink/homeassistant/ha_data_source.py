@@ -12,6 +12,8 @@ wslogger.setLevel(logging.WARNING)
 class HASource(DataSource):
     # Primary output property
     _power = 0.0
+    entity_id = None
+    stale = False
 
     def add_controller(self, controller):
         # Add self to passed-in Websocket controller
@@ -158,7 +160,15 @@ class HASource(DataSource):
 
     @power.setter
     def power(self, new_power):
-        self._power = new_power
+        self.set_power(new_power)
+        self.stale = False
+
+    def mark_stale(self):
+        # No updates available (i.e. lost connection), so report off usage until updated
+        logging.info(f"Marking {self.identifier} as stale, setting to off_usage")
+        self.state = False
+        self.power = self.off_usage
+        self.stale = True
 
 
 if __name__ == "__main__":
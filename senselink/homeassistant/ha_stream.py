@@ -0,0 +1,43 @@
+# Copyright 2022, Charles Powell
+import re
+import json
+
+RESULT_START = re.compile(r'"result"\s*:\s*\[')
+FRAME_ID = re.compile(r'\{\s*"id"\s*:\s*(\d+)')
+# Whitespace and commas between array elements
+SEPARATOR = re.compile(r'[\s,]*')
+
+_decoder = json.JSONDecoder()
+
+
+def frame_id(frame):
+    # Get the message ID of a raw frame without parsing it, assuming 'id' is the first key
+    match = FRAME_ID.match(frame)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def iter_tracked_states(frame, entity_ids, pause_every=500):
+    # Walk the 'result' array of a raw get_states frame one element at a time, so only a single state is
+    # decoded in memory at once, yielding states for the entity_ids provided. Elements are decoded whole,
+    # so objects nested in attributes (i.e. template or group attributes listing other entity states) are
+    # never mistaken for states. A None state is also yielded every pause_every states, so that callers can
+    # give control back to the event loop during large frames.
+    match = RESULT_START.search(frame)
+    if match is None:
+        return
+    pos = SEPARATOR.match(frame, match.end()).end()
+    scanned = 0
+    while pos < len(frame) and frame[pos] != ']':
+        status, pos = _decoder.raw_decode(frame, pos)
+        pos = SEPARATOR.match(frame, pos).end()
+        scanned += 1
+        if isinstance(status, dict) and status.get('entity_id') in entity_ids:
+            yield status
+        elif scanned % pause_every == 0:
+            yield None
+
+
+if __name__ == "__main__":
+    pass
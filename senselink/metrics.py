@@ -0,0 +1,64 @@
+# Copyright 2022, Charles Powell
+import logging
+
+
+class LatencyTracker:
+    # Rolling latency percentiles over a fixed window of samples, with optional SLO checking
+    def __init__(self, window=1024, slo=None):
+        self.window = window
+        # Latency SLO [seconds], None to disable slow request logging
+        self.slo = slo
+        self._samples = [0.0] * window
+        self._index = 0
+        self.count = 0
+        self.max = 0.0
+        self.slow_count = 0
+        self.last_slow = None
+
+    def record(self, latency, breakdown=None):
+        self._samples[self._index] = latency
+        self._index = (self._index + 1) % self.window
+        self.count += 1
+        if latency > self.max:
+            self.max = latency
+
+        if self.slo is not None and latency > self.slo:
+            self.slow_count += 1
+            self.last_slow = breakdown or {'total': latency}
+            logging.warning(f"Sense response took {format_ms(latency)}, exceeding SLO of {format_ms(self.slo)}: "
+                            f"{format_breakdown(self.last_slow)}")
+            return True
+        return False
+
+    def percentiles(self):
+        samples = sorted(self._samples[:min(self.count, self.window)])
+        if not samples:
+            return {'p50': None, 'p95': None, 'p99': None}
+
+        def pick(fraction):
+            return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+        return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+    def stats(self):
+        stats = self.percentiles()
+        stats.update({
+            'count': self.count,
+            'max': self.max,
+            'slo': self.slo,
+            'slow_count': self.slow_count,
+            'last_slow': self.last_slow,
+        })
+        return stats
+
+
+def format_ms(seconds):
+    return f'{seconds * 1000:.2f}ms'
+
+
+def format_breakdown(breakdown):
+    parts = [f'{key} {format_ms(value)}' for key, value in breakdown.items()
+             if isinstance(value, float)]
+    slowest = breakdown.get('slowest')
+    if slowest:
+        parts.append('slowest plugs: ' + ', '.join(f'{plug_id} {format_ms(t)}' for plug_id, t in slowest))
+    return ', '.join(parts)
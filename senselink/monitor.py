@@ -0,0 +1,104 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import bisect
+import logging
+import sys
+import threading
+import time
+import traceback
+
+# Lag histogram bucket upper bounds [seconds], with a final overflow bucket
+LAG_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+# Number of innermost stack frames kept when attributing a stall
+STACK_DEPTH = 8
+
+
+class LoopMonitor:
+    # Measures event loop scheduling lag with a sleeping probe, and attributes stalls using a watchdog thread.
+    # The probe updates a heartbeat each time it runs; if the heartbeat falls behind by more than the threshold,
+    # the watchdog captures what the loop thread is running (current task and stack) while it is still blocked.
+    def __init__(self, interval=0.1, threshold=0.1):
+        self.interval = interval
+        self.threshold = threshold
+
+        self.loop = None
+        self._loop_thread_id = None
+        self._heartbeat = None
+        self._watchdog = None
+        self._running = False
+        # Attribution captured by the watchdog for the current stall
+        self._capture = None
+
+        self.histogram = [0] * (len(LAG_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.stall_count = 0
+        self.last_stall = None
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._running = True
+        self._watchdog = threading.Thread(target=self.watch, name='SenseLinkLoopWatchdog', daemon=True)
+        self._watchdog.start()
+        logging.info(f"Monitoring event loop lag every {self.interval * 1000:.0f}ms, "
+                     f"stall threshold {self.threshold * 1000:.0f}ms")
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._heartbeat = now
+                self.record(max(now - expected, 0.0))
+        finally:
+            self._running = False
+
+    def record(self, lag):
+        self.histogram[bisect.bisect_left(LAG_BUCKETS, lag)] += 1
+        self.count += 1
+        self.total += lag
+        if lag > self.max:
+            self.max = lag
+
+        capture, self._capture = self._capture, None
+        if lag > self.threshold:
+            self.stall_count += 1
+            self.last_stall = {'lag': lag, 'time': time.time()}
+            if capture is not None:
+                self.last_stall.update(capture)
+            logging.warning(f"Event loop stalled for {lag * 1000:.1f}ms"
+                            + (f" running {capture['task']}:\n{capture['stack']}" if capture else ""))
+
+    def watch(self):
+        # Watchdog thread
+        while self._running:
+            time.sleep(self.threshold / 2)
+            if self._capture is None and time.monotonic() - self._heartbeat > self.interval + self.threshold:
+                self._capture = self.capture()
+
+    def capture(self):
+        # Describe what the loop thread is doing right now
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame, limit=STACK_DEPTH)).rstrip() if frame is not None else ''
+        task = asyncio.current_task(self.loop) if self.loop is not None else None
+        if task is not None:
+            coro = task.get_coro()
+            task_name = f"task {task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+        else:
+            task_name = 'callback'
+        return {'task': task_name, 'stack': stack}
+
+    def stats(self):
+        buckets = {f'<={bound * 1000:g}ms': count for bound, count in zip(LAG_BUCKETS, self.histogram)}
+        buckets[f'>{LAG_BUCKETS[-1] * 1000:g}ms'] = self.histogram[-1]
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'threshold': self.threshold,
+            'stalls': self.stall_count,
+            'last_stall': self.last_stall,
+            'histogram': buckets,
+        }
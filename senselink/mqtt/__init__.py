@@ -1,2 +1,3 @@
 from .mqtt_controller import MQTTController
 from .mqtt_data_source import MQTTSource
+from .mqtt_publisher import MQTTPublisher
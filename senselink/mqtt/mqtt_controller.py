@@ -2,6 +2,7 @@
 
 import logging
 import asyncio
+import time
 from aiomqtt import Client, MqttError
 from typing import Dict
 
@@ -14,81 +15,233 @@ MQTT_LOGGER.setLevel(logging.WARNING)
 class MQTTController:
     client = None
     topics: Dict[str, MQTTListener] = None
+    recorder = None
+    accounting = None
 
-    def __init__(self, host, port=1883, username=None, password=None):
+    def __init__(self, host, port=1883, username=None, password=None, coalesce=False):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
+        # Queue incoming messages, keeping only the latest per topic, rather than handling each in turn
+        self.coalesce = coalesce
 
         self.data_sources = []
         self.listeners = {}
+        # Publishers sharing this connection, notified on (re)connect
+        self.publishers = []
 
         self.listen_task = None
+        self.drain_task = None
+        # Subscriptions to topics of data sources added while connected
+        self._subscribe_tasks = set()
+        self._listeners_built = False
+        # Latest pending payload by topic, in arrival order
+        self._pending = {}
+        self._pending_event = None
+
+        # Connection and message statistics
+        self.connect_count = 0
+        self.disconnect_count = 0
+        self.messages_received = 0
+        self.messages_unrouted = 0
+        self.topic_counts = {}
+        self.coalesced_count = 0
+        self.max_queue_depth = 0
+
+    @property
+    def broker(self):
+        if self.username is not None:
+            return f'{self.username}@{self.host}:{self.port}'
+        return f'{self.host}:{self.port}'
+
     async def connect(self):
         # Create task
         await self.client_handler()
 
-    async def client_handler(self):
+    def build_listeners(self):
+        if self._listeners_built:
+            return
+        self._listeners_built = True
         # Add tasks for each data source handler
         for ds in self.data_sources:
-            # Get handlers from data source
-            ds_listeners = ds.listeners()
-            # Iterate through data source listeners and convert to
-            # 'prime' listeners for each topic
-            for listener in ds_listeners:
-                topic = listener.topic
-                funcs = listener.handlers
-                if topic in self.listeners:
-                    # Add these handlers to existing top level topic handler
-                    logging.debug(f'Adding handlers for existing prime Listener: {topic}')
-                    ext_topic = self.listeners[topic]
-                    ext_topic.handlers.extend(funcs)
-                else:
-                    # Add this instance as a new top level handler
-                    logging.debug(f'Creating new prime Listener for topic: {topic}')
-                    self.listeners[topic] = MQTTListener(topic, funcs)
+            self.add_listeners(ds)
+
+    def add_listeners(self, ds):
+        # Add the data source's handlers to the 'prime' listener for each topic, returning newly added topics
+        new_topics = []
+        for listener in ds.listeners():
+            topic = listener.topic
+            funcs = listener.handlers
+            if topic in self.listeners:
+                # Add these handlers to existing top level topic handler
+                logging.debug(f'Adding handlers for existing prime Listener: {topic}')
+                ext_topic = self.listeners[topic]
+                ext_topic.handlers.extend(func for func in funcs if func not in ext_topic.handlers)
+            else:
+                # Add this instance as a new top level handler
+                logging.debug(f'Creating new prime Listener for topic: {topic}')
+                self.listeners[topic] = MQTTListener(topic, funcs)
+                new_topics.append(topic)
+        return new_topics
+
+    def add_source(self, ds):
+        # Route messages to a data source added at runtime, subscribing to its topics if connected
+        if ds not in self.data_sources:
+            self.data_sources.append(ds)
+        if not self._listeners_built:
+            # Included when listeners are built on start
+            return
+        new_topics = self.add_listeners(ds)
+        if new_topics and self.client is not None:
+            task = asyncio.get_running_loop().create_task(self.subscribe(self.client, new_topics))
+            self._subscribe_tasks.add(task)
+            task.add_done_callback(self._subscribe_tasks.discard)
+
+    def remove_source(self, ds):
+        # Stop routing messages to the data source
+        if ds in self.data_sources:
+            self.data_sources.remove(ds)
+        for listener in self.listeners.values():
+            listener.handlers = [h for h in listener.handlers if getattr(h, '__self__', None) is not ds]
+
+    @staticmethod
+    async def subscribe(client, topics):
+        try:
+            for topic in topics:
+                await client.subscribe(topic)
+        except MqttError as error:
+            # All topics are subscribed again on reconnect
+            logging.error(f'Unable to subscribe to MQTT topics {topics}: {error}')
+
+    async def client_handler(self):
+        self.build_listeners()
 
         logging.info(f"Starting MQTT client to URL: {self.host}")
         reconnect_interval = 10  # [seconds]
         loop = asyncio.get_event_loop()
 
+        if self.coalesce:
+            # Process queued messages independently of receiving them
+            self._pending_event = asyncio.Event()
+            self.drain_task = loop.create_task(self.drain())
+
         while True:
             try:
                 # Listen for MQTT messages in (unawaited) asyncio task
                 self.listen_task = loop.create_task(self.listen())
                 await self.listen_task
             except MqttError as error:
+                self.disconnect_count += 1
                 logging.error(f'Disconnected from MQTT broker with error: {error}')
                 logging.debug(f'MQTT client disconnected/ended, reconnecting in {reconnect_interval}...')
                 # Cancel task and wait
                 self.listen_task.cancel()
                 await asyncio.sleep(reconnect_interval)
             except Exception as error:
+                self.disconnect_count += 1
                 logging.error(f'Stopping MQTT client with error: {error}')
                 logging.debug(f'MQTT client disconnected/ended, reconnecting in {reconnect_interval}...')
                 # Cancel task and wait
                 self.listen_task.cancel()
                 await asyncio.sleep(reconnect_interval)
             except (KeyboardInterrupt, asyncio.CancelledError):
+                if self.drain_task is not None:
+                    self.drain_task.cancel()
                 return False
 
     async def listen(self):
-        logging.info(f'MQTT client connected')
         async with Client(self.host, self.port, username=self.username, password=self.password) as client:
-            async with client.messages() as messages:
-                # Subscribe to specified topics
-                for topic, handlers in self.listeners.items():
-                    await client.subscribe(topic)
-                # Handle messages that come in
-                async for message in messages:
-                    topic = message.topic.value
-                    handlers = self.listeners[topic].handlers
-                    logging.debug(f'Got message for topic: {topic}')
-                    for func in handlers:
+            logging.info(f'MQTT client connected to {self.broker}')
+            self.connect_count += 1
+            self.client = client
+            try:
+                for publisher in self.publishers:
+                    publisher.connected()
+                async with client.messages() as messages:
+                    # Subscribe to specified topics
+                    for topic in list(self.listeners):
+                        await client.subscribe(topic)
+                    # Handle messages that come in
+                    async for message in messages:
                         # Decode to UTF-8
-                        payload = message.payload.decode()
-                        await func(payload)
+                        await self.receive(message.topic.value, message.payload.decode())
+            finally:
+                self.client = None
+
+    async def receive(self, topic, payload):
+        self.messages_received += 1
+        if self.recorder is not None:
+            self.recorder.record_mqtt(self.broker, topic, payload)
+        if self.coalesce:
+            self.enqueue(topic, payload)
+        else:
+            await self.dispatch(topic, payload)
+
+    def enqueue(self, topic, payload):
+        # Only the latest payload is kept for each subscribed topic, so the queue is bounded by the number of
+        # listeners without ever dropping a topic's newest value
+        if topic not in self.listeners:
+            # Drop unrouted messages before queueing
+            self.messages_unrouted += 1
+            logging.debug(f'No listener for topic: {topic}')
+            return
+        if topic in self._pending:
+            # Replace the prior (unprocessed) payload for this topic
+            self.coalesced_count += 1
+        self._pending[topic] = payload
+        self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+        self._pending_event.set()
+
+    async def drain(self):
+        while True:
+            await self._pending_event.wait()
+            self._pending_event.clear()
+            while self._pending:
+                topic = next(iter(self._pending))
+                payload = self._pending.pop(topic)
+                try:
+                    await self.dispatch(topic, payload)
+                except Exception as error:
+                    logging.error(f'Error handling MQTT message for topic {topic}: {error}')
+
+    async def dispatch(self, topic, payload):
+        listener = self.listeners.get(topic)
+        if listener is None:
+            self.messages_unrouted += 1
+            logging.debug(f'No listener for topic: {topic}')
+            return
+        self.topic_counts[topic] = self.topic_counts.get(topic, 0) + 1
+        logging.debug(f'Got message for topic: {topic}')
+        if self.accounting is None:
+            for func in listener.handlers:
+                await func(payload)
+            return
+
+        # Account time to each handler's data source, and the total to this connection
+        dispatch_start = time.perf_counter()
+        try:
+            for func in listener.handlers:
+                start = time.perf_counter()
+                await func(payload)
+                self.accounting.add(f'plug {func.__self__.identifier}', time.perf_counter() - start)
+        finally:
+            self.accounting.add(f'mqtt {self.broker}', time.perf_counter() - dispatch_start)
+
+    def stats(self):
+        return {
+            'connects': self.connect_count,
+            'disconnects': self.disconnect_count,
+            'data_sources': len(self.data_sources),
+            'topics': len(self.listeners),
+            'messages': self.messages_received,
+            'unrouted': self.messages_unrouted,
+            'queue_depth': len(self._pending),
+            'max_queue_depth': self.max_queue_depth,
+            'coalesced': self.coalesced_count,
+            'topic_messages': dict(self.topic_counts),
+            'publishers': [publisher.stats() for publisher in self.publishers],
+        }
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@
 import logging
 import asyncio
 import json
+import time
 from math import isclose
 from senselink.common import *
 from senselink.data_source import DataSource
@@ -13,6 +14,11 @@ class MQTTSource(DataSource):
     # Primary output property
     _power = 0.0
     timer = None
+    _timeout_deadline = None
+    lazy = False
+    # Latest unparsed power topic payload, and update deadline, in lazy mode
+    _pending_power = None
+    _lazy_deadline = None
 
     def add_controller(self, controller):
         # Add self to passed-in MQTT Data Controller
@@ -39,6 +45,8 @@ class MQTTSource(DataSource):
             self.attribute_topic = details.get('attribute_topic') or None
             self.attribute_topic_keypath = details.get('attribute_topic_keypath') or None
             self.timeout_duration = details.get('timeout_duration') or None
+            # Store power topic payloads as received, and only parse them when power is read
+            self.lazy = details.get('lazy') or False
 
             if not any((self.attribute_topic, self.power_topic, self.state_topic)):
                 # Need at least ONE topic
@@ -52,9 +60,14 @@ class MQTTSource(DataSource):
 
             self.attribute_delta = self.attribute_max - self.attribute_min
 
-    async def timeout(self, timeout_value):
-        # Sleep for specified time (seconds)
-        await asyncio.sleep(timeout_value)
+    def timeout(self):
+        # Timer may have been set before the most recent update, so check deadline
+        loop = asyncio.get_event_loop()
+        remaining = self._timeout_deadline - loop.time()
+        if remaining > 0:
+            self.timer = loop.call_later(remaining, self.timeout)
+            return
+        self.timer = None
         # If we get here, set to off_usage
         logging.info(f'Update timeout reached for {self.identifier}, setting to off_usage')
         self.update_power(self.off_usage, timeout=False)
@@ -62,42 +75,66 @@ class MQTTSource(DataSource):
 
     @property
     def power(self):
+        if self._pending_power is not None:
+            # Parse latest payload received in lazy mode
+            value = self._pending_power
+            self._pending_power = None
+            self.update_power(value, timeout=False)
+        if self._lazy_deadline is not None and time.monotonic() > self._lazy_deadline:
+            self._lazy_deadline = None
+            logging.info(f'Update timeout reached for {self.identifier}, setting to off_usage')
+            self.update_power(self.off_usage, timeout=False)
+            self.state = False
         return self._power
 
     def update_power(self, value, timeout=True):
-        if self.power_topic_keypath is not None:
+        # Any direct update supersedes a pending lazy payload
+        self._pending_power = None
+        # Only payloads from the power topic (strings) need extracting, not internally set values
+        if self.power_topic_keypath is not None and isinstance(value, str):
             logging.debug(f'Extracting power from JSON message, at key path {self.power_topic_keypath}')
-            # Extract value from (assumed) JSON message at keypath
-            message = json.loads(value)
-            # Overwrite value variable with what is extracted from JSON
-            value = safekey(message, self.power_topic_keypath)
+            # Extract value from (assumed) JSON message at keypath. In lazy mode this runs when power is read,
+            # so a bad payload must not raise (keep the last value instead).
+            try:
+                message = json.loads(value)
+                # Overwrite value variable with what is extracted from JSON
+                value = safekey(message, self.power_topic_keypath)
+            except (ValueError, TypeError) as err:
+                logging.warning(f'Failed to parse power topic JSON for {self.identifier} ({err}), ignoring')
+                return
             if value is None:
                 logging.warning(f'Update on power topic failed to find value at power keypath ({self.power_topic_keypath})')
                 return
 
         try:
             fval = float(value)
-        except ValueError:
+        except (ValueError, TypeError):
             logging.warning(f'Failed to convert power value ("{value}") for {self.identifier} to float, ignoring')
             return
 
-        # Reset previous timer
+        # Extend timeout deadline, only creating a timer if one isn't already pending
         if self.timeout_duration is not None and timeout:
-            if self.timer is not None:
-                logging.debug(f'Cancelling prior MQTT timeout timer')
-                self.timer.cancel()
-            logging.debug(f'Created MQTT timer with duration {self.timeout_duration}')
-            self.timer = asyncio.create_task(self.timeout(self.timeout_duration))
-
-        if not isclose(fval, self.power):
-            self._power = fval
+            loop = asyncio.get_event_loop()
+            self._timeout_deadline = loop.time() + self.timeout_duration
+            if self.timer is None:
+                logging.debug(f'Created MQTT timer with duration {self.timeout_duration}')
+                self.timer = loop.call_later(self.timeout_duration, self.timeout)
+
+        if not isclose(fval, self._power):
+            self.set_power(fval)
             # Assume off if reported power usage is close to off_usage
-            if isclose(self.power, self.off_usage):
+            if isclose(fval, self.off_usage):
                 self.state = False
                 logging.debug(f'Power equal to off_usage for {self.identifier}, assuming off')
             logging.debug(f'Power updated for {self.identifier}: {round(fval, 4)}')
 
     async def power_handler(self, value):
+        if self.lazy and not self.observers:
+            # Defer parsing until power is read (unless observed, as changes must be notified as they happen)
+            self._pending_power = value
+            if self.timeout_duration is not None:
+                self._lazy_deadline = time.monotonic() + self.timeout_duration
+            return
         logging.debug(f'Power topic update for {self.identifier}: {value}')
         self.update_power(value)
 
@@ -162,7 +199,7 @@ class MQTTSource(DataSource):
             attribute_value = float(value)
         except ValueError:
             logging.warning(f'Non-float value ("{value}") received for attribute update, unable to update!')
-            self._power = self.off_usage
+            self.set_power(self.off_usage)
             self.state = False
             return
 
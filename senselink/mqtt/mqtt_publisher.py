@@ -0,0 +1,117 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import logging
+import time
+from aiomqtt import MqttError
+
+
+class MQTTPublisher:
+    # Publishes plug power values to MQTT when they change, using an existing MQTTController connection.
+    # Changes are collected and published in batches (so a bulk update changing many plugs is sent together),
+    # changes within the deadband of the last published value are skipped, and each plug is published at
+    # most once per min_interval (with the latest value sent when the interval has passed).
+    def __init__(self, controller, plugs, topic='senselink/{plug}/power', deadband=0.0, min_interval=0.0,
+                 retain=False, qos=0):
+        self.controller = controller
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.retain = retain
+        self.qos = qos
+        controller.publishers.append(self)
+
+        # Data source to topic, supporting {plug} (identifier) and {mac} placeholders
+        self.topics = {plug.data_source: topic.format(plug=plug.identifier, mac=plug.mac) for plug in plugs}
+        # Latest unpublished power, and last published (power, time), by data source
+        self._pending = {}
+        self._published = {}
+        self._event = None
+
+        # Statistics
+        self.published_count = 0
+        self.batch_count = 0
+        self.suppressed_count = 0
+        self.error_count = 0
+
+        for ds in self.topics:
+            ds.add_observer(self.power_changed)
+
+    def power_changed(self, source, old_power, new_power):
+        self._pending[source] = new_power
+        if self._event is not None:
+            self._event.set()
+
+    def connected(self):
+        # Publish all current values on (re)connect
+        self._published = {}
+        for ds in self.topics:
+            self._pending[ds] = ds.power
+        if self._event is not None:
+            self._event.set()
+
+    def take_due(self, now):
+        # Returns the batch of (data source, power) to publish now, and seconds until the next deferred value
+        # is due (or None)
+        batch = []
+        next_due = None
+        for ds, power in list(self._pending.items()):
+            last = self._published.get(ds)
+            if power is None:
+                del self._pending[ds]
+                continue
+            if last is not None:
+                last_power, last_time = last
+                if abs(power - last_power) < self.deadband:
+                    del self._pending[ds]
+                    self.suppressed_count += 1
+                    continue
+                wait = last_time + self.min_interval - now
+                if wait > 0:
+                    next_due = wait if next_due is None else min(next_due, wait)
+                    continue
+            del self._pending[ds]
+            self._published[ds] = (power, now)
+            batch.append((ds, power))
+        return batch, next_due
+
+    async def run(self):
+        self._event = asyncio.Event()
+        timeout = None
+        while True:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+            if self.controller.client is None:
+                # Wait for connected()
+                timeout = None
+                continue
+            batch, timeout = self.take_due(time.monotonic())
+            if batch:
+                await self.send(batch)
+
+    async def send(self, batch):
+        self.batch_count += 1
+        client = self.controller.client
+        for index, (ds, power) in enumerate(batch):
+            try:
+                await client.publish(self.topics[ds], payload=f'{float(power):.2f}', qos=self.qos, retain=self.retain)
+                self.published_count += 1
+            except MqttError as error:
+                self.error_count += 1
+                logging.warning(f'Unable to publish power to MQTT broker {self.controller.broker}: {error}')
+                # Retry unpublished values (unless superseded) once reconnected
+                for retry_ds, retry_power in batch[index:]:
+                    self._published.pop(retry_ds, None)
+                    self._pending.setdefault(retry_ds, retry_power)
+                return
+
+    def stats(self):
+        return {
+            'plugs': len(self.topics),
+            'pending': len(self._pending),
+            'published': self.published_count,
+            'batches': self.batch_count,
+            'suppressed': self.suppressed_count,
+            'errors': self.error_count,
+        }
@@ -0,0 +1,116 @@
+# Copyright 2022, Charles Powell
+import hashlib
+import logging
+
+from .data_source import DataSource, AggregateSource
+from .plug_instance import PlugInstance
+
+# Area used for plugs without an area tag
+OTHER_AREA = 'Other'
+# Variance score for dynamic plugs without a known power range, so they are merged last
+UNKNOWN_VARIANCE = 1e6
+AUTO_MAC_OUI = '53:75:31'
+
+
+class AggregatePlanner:
+    def __init__(self, max_plugs, mac_oui=AUTO_MAC_OUI):
+        self.max_plugs = max_plugs
+        self.mac_oui = mac_oui
+
+    @staticmethod
+    def variance_score(plug):
+        # Estimate how much a plug's power varies, as plugs with (near) constant power are the
+        # least useful for Sense to see individually
+        ds = plug.data_source
+        if type(ds) is DataSource:
+            # Static plug
+            return 0.0
+        power_range = ds.max_watts - ds.min_watts
+        if power_range > 0:
+            return power_range
+        return UNKNOWN_VARIANCE
+
+    def plan(self, plugs):
+        # Returns dict of area to list of plugs to aggregate, such that at most max_plugs are reported
+        reported = [p for p in plugs if not p.in_aggregate]
+        excess = len(reported) - self.max_plugs
+        if excess <= 0:
+            logging.info(f"{len(reported)} plugs reported, within budget of {self.max_plugs}, no aggregates needed")
+            return {}
+
+        areas = {}
+        for plug in reported:
+            if plug.keep_discrete or isinstance(plug.data_source, AggregateSource):
+                continue
+            areas.setdefault(plug.area or OTHER_AREA, []).append(plug)
+        for pending in areas.values():
+            pending.sort(key=self.variance_score)
+
+        groups = {}
+        while excess > 0:
+            choice = self.cheapest_merge(areas, groups)
+            if choice is None:
+                # No area can be reduced further, so combine lone plugs into the catch-all area
+                singles = [a for a, pending in areas.items() if pending and a not in groups and a != OTHER_AREA]
+                if not singles:
+                    break
+                for area in singles:
+                    areas.setdefault(OTHER_AREA, []).extend(areas.pop(area))
+                areas[OTHER_AREA].sort(key=self.variance_score)
+                continue
+
+            area, take = choice
+            groups.setdefault(area, []).extend(areas[area][:take])
+            del areas[area][:take]
+            excess -= 1
+
+        if excess > 0:
+            logging.warning(f"Unable to fit plugs within budget of {self.max_plugs}, "
+                            f"{self.max_plugs + excess} plugs will be reported")
+        return groups
+
+    def cheapest_merge(self, areas, groups):
+        # Find the merge that removes one reported plug, with the lowest total variance
+        best = None
+        for area, pending in areas.items():
+            if area in groups and len(pending) >= 1:
+                # Add to existing aggregate
+                take = 1
+            elif len(pending) >= 2:
+                # Create a new aggregate from two plugs
+                take = 2
+            else:
+                continue
+            cost = sum(self.variance_score(p) for p in pending[:take])
+            if best is None or cost < best[0]:
+                best = (cost, area, take)
+        if best is None:
+            return None
+        return best[1], best[2]
+
+    def generate_mac(self, identifier, used_macs):
+        # Derive a stable MAC from the aggregate identifier, so Sense sees the same plug each run
+        seed = identifier
+        while True:
+            digest = hashlib.sha1(seed.encode()).digest()
+            mac = self.mac_oui + ''.join(f':{b:02x}' for b in digest[:3])
+            if mac not in used_macs:
+                return mac
+            seed += '_'
+
+    def create_instances(self, groups, used_macs):
+        instances = {}
+        for area, members in groups.items():
+            identifier = f'Auto_{area}'
+            mac = self.generate_mac(identifier, set(used_macs) | set(instances.keys()))
+            device_id = hashlib.sha1(f'device_{identifier}'.encode()).hexdigest()
+            instance = PlugInstance(identifier, f'{area} (Aggregate)', mac, device_id)
+            ds = AggregateSource(identifier, {'elements': [p.identifier for p in members]}, None)
+            ds.elements = members
+            instance.data_source = ds
+            for plug in members:
+                plug.in_aggregate = True
+            instances[mac] = instance
+            logging.info(f"Generated aggregate {identifier} ({mac}) from: "
+                         f"{', '.join(p.identifier for p in members)}")
+        return instances
@@ -42,8 +42,20 @@ class PlugInstance:
     start_time = None
     data_source = None
     in_aggregate = False  # Assume not in aggregate to start
+    # Aggregate planner hints
+    area = None
+    keep_discrete = False
     skip_rate = 0.0
     _response_counter = 0
+    # Change-based response suppression
+    suppress_unchanged = False
+    change_tolerance = 0.0
+    max_skip = 4
+    _last_reported = None
+    _unchanged_count = 0
+    # Response statistics
+    response_count = 0
+    suppressed_count = 0
 
     def __init__(self, identifier, alias=None, mac=None, device_id=None):
         self.identifier = identifier
@@ -86,19 +98,30 @@ class PlugInstance:
                 # Create and configure instance
                 instance = cls(plug_id, alias, mac, device_id)
                 instance.skip_rate = skip_rate
+                instance.suppress_unchanged = details.get('suppress_unchanged') or False
+                instance.change_tolerance = details.get('change_tolerance') or 0.0
+                max_skip = details.get('max_skip')
+                if max_skip is None:
+                    max_skip = 4
+                elif isinstance(max_skip, bool) or not isinstance(max_skip, int) or max_skip < 0:
+                    raise AssertionError(f"Configuration Error: Plug {plug_id} max_skip must be a non-negative "
+                                         f"integer (got {max_skip!r})")
+                instance.max_skip = max_skip
+                instance.area = details.get('area') or details.get('area_id')
+                instance.keep_discrete = details.get('keep_discrete') or False
 
                 # Generate data source with details, and assign
                 instance.data_source = data_source_class(plug_id, details, data_controller)
 
-                # Check if this MAC has already been used
-                if mac in instances.keys():
+                # Check if this MAC has already been used (keyed by the instance MAC, as it may have been generated)
+                if instance.mac in instances.keys():
                     # Assertion error - can't use the same MAC twice!
-                    prev_id = instances[mac]
+                    prev_id = instances[instance.mac].identifier
                     raise AssertionError(
                         f"Configuration Error: Two plugs configured with the same MAC address! ({prev_id}, {plug_id})")
 
                 # Add this plug to list of instances
-                instances[mac] = instance
+                instances[instance.mac] = instance
 
                 logging.debug(f"Added plug: {plug_id}")
 
@@ -108,9 +131,10 @@ class PlugInstance:
     def power(self):
         return self.data_source.power
 
-    def generate_response(self):
+    def generate_response(self, power=None):
         # Grab latest values from source
-        power = self.data_source.power
+        if power is None:
+            power = self.data_source.power
         current = self.data_source.current
         voltage = self.data_source.voltage
 
@@ -143,7 +167,20 @@ class PlugInstance:
 
         return response
 
-    def should_respond(self, apply_counter=True):
+    def should_respond(self, apply_counter=True, power=None):
+        if self.suppress_unchanged:
+            respond = self.power_changed(apply_counter, power)
+        else:
+            respond = self.skip_counter_allows(apply_counter)
+
+        if apply_counter:
+            if respond:
+                self.response_count += 1
+            else:
+                self.suppressed_count += 1
+        return respond
+
+    def skip_counter_allows(self, apply_counter=True):
         if self._response_counter < 1:
             if apply_counter:
                 self._response_counter = self.skip_rate
@@ -154,6 +191,30 @@ class PlugInstance:
                 self._response_counter = max(self._response_counter - 1, 0)
             return False
 
+    def power_changed(self, apply_counter=True, power=None):
+        # Respond when power has changed beyond the tolerance, or if max_skip responses have been suppressed
+        if power is None:
+            power = self.power
+        if (self._last_reported is None or abs(power - self._last_reported) > self.change_tolerance
+                or self._unchanged_count >= self.max_skip):
+            if apply_counter:
+                self._last_reported = power
+                self._unchanged_count = 0
+            return True
+        else:
+            if apply_counter:
+                self._unchanged_count += 1
+            return False
+
+    @property
+    def response_stats(self):
+        total = self.response_count + self.suppressed_count
+        return {
+            'responses': self.response_count,
+            'suppressed': self.suppressed_count,
+            'suppressed_fraction': self.suppressed_count / total if total else 0.0,
+        }
+
 
 if __name__ == "__main__":
     # Convenience function to generate a MAC address and Device ID
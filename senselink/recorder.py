@@ -0,0 +1,192 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import logging
+import os
+import threading
+import time
+from struct import Struct
+
+# Log file layout:
+#   file header:  MAGIC + version byte
+#   each record:  timestamp (double), kind (uint8), channel length (uint16), payload length (uint32),
+#                 followed by the channel and payload bytes
+MAGIC = b'SLRC'
+VERSION = 1
+RECORD_HEADER = Struct('>dBHI')
+
+KIND_HASS = 1
+KIND_MQTT = 2
+KIND_SENSE = 3
+
+# Flush buffered records at least this often [seconds]
+FLUSH_INTERVAL = 1.0
+
+
+class TrafficRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._last_flush = time.monotonic()
+        # Records may be written from the UDP responder thread, as well as the event loop
+        self._lock = threading.Lock()
+
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab')
+        if new_file:
+            self._file.write(MAGIC + bytes([VERSION]))
+        logging.info(f"Recording ingest and Sense traffic to {path}")
+
+    def record(self, kind, channel, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        channel = channel.encode()
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD_HEADER.pack(time.time(), kind, len(channel), len(payload)))
+            self._file.write(channel)
+            self._file.write(payload)
+            self.records += 1
+
+            now = time.monotonic()
+            if now - self._last_flush > FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+
+    def record_hass(self, url, message):
+        self.record(KIND_HASS, url, message)
+
+    def record_mqtt(self, broker, topic, payload):
+        # Topic and payload are separated by a null byte, which is not valid in an MQTT topic
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.record(KIND_MQTT, broker, topic.encode() + b'\x00' + payload)
+
+    def record_sense(self, data, addr):
+        self.record(KIND_SENSE, f'{addr[0]}:{addr[1]}', data)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            logging.info(f"Stopped recording, {self.records} records written to {self.path}")
+
+
+def read_records(path):
+    # Generator of (timestamp, kind, channel, payload) tuples from a recorded log
+    with open(path, 'rb') as file:
+        header = file.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a SenseLink traffic recording")
+        if header[len(MAGIC)] != VERSION:
+            raise ValueError(f"Unsupported recording version {header[len(MAGIC)]} in {path}")
+
+        while True:
+            raw_header = file.read(RECORD_HEADER.size)
+            if len(raw_header) < RECORD_HEADER.size:
+                # End of file (or truncated final record)
+                return
+            timestamp, kind, channel_len, payload_len = RECORD_HEADER.unpack(raw_header)
+            channel = file.read(channel_len).decode()
+            payload = file.read(payload_len)
+            if len(payload) < payload_len:
+                logging.warning(f"Truncated final record in {path}, stopping replay")
+                return
+            yield timestamp, kind, channel, payload
+
+
+class _NullWebsocket:
+    # Stands in for the HASS websocket during replay, discarding anything sent
+    async def send(self, message):
+        pass
+
+
+class _NullTransport:
+    # Stands in for the UDP transport during replay, counting (but discarding) responses
+    def __init__(self):
+        self.sent = 0
+
+    def sendto(self, data, addr=None):
+        self.sent += 1
+
+    def close(self):
+        pass
+
+
+class TrafficReplayer:
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        # A speed of 0 (or None) replays as fast as possible
+        self.speed = speed or 0
+        self.counts = {KIND_HASS: 0, KIND_MQTT: 0, KIND_SENSE: 0}
+        self.skipped = 0
+        self.elapsed = None
+
+    @staticmethod
+    def _target_for(channel, targets):
+        target = targets.get(channel)
+        if target is None and len(targets) == 1:
+            # Allow replaying against a single controller with a different URL/host
+            target = next(iter(targets.values()))
+        return target
+
+    async def replay(self, hass_controllers=None, mqtt_controllers=None, protocol=None):
+        # Controllers are passed as dicts, keyed by the channel they were recorded under
+        hass_controllers = hass_controllers or {}
+        mqtt_controllers = mqtt_controllers or {}
+        websocket = _NullWebsocket()
+        if protocol is not None and protocol.transport is None:
+            protocol.connection_made(_NullTransport())
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        first_ts = None
+
+        for timestamp, kind, channel, payload in read_records(self.path):
+            if first_ts is None:
+                first_ts = timestamp
+
+            if self.speed > 0:
+                delay = (timestamp - first_ts) / self.speed - (loop.time() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif sum(self.counts.values()) % 100 == 0:
+                # Let other tasks run periodically when replaying at max speed
+                await asyncio.sleep(0)
+
+            if kind == KIND_HASS:
+                controller = self._target_for(channel, hass_controllers)
+                if controller is None:
+                    self.skipped += 1
+                    continue
+                await controller.on_message(websocket, payload.decode())
+            elif kind == KIND_MQTT:
+                controller = self._target_for(channel, mqtt_controllers)
+                if controller is None:
+                    self.skipped += 1
+                    continue
+                topic, _, message = payload.partition(b'\x00')
+                await controller.dispatch(topic.decode(), message.decode())
+            elif kind == KIND_SENSE:
+                if protocol is None:
+                    self.skipped += 1
+                    continue
+                host, _, port = channel.rpartition(':')
+                protocol.datagram_received(payload, (host, int(port)))
+            else:
+                logging.warning(f"Unknown record kind {kind} in {self.path}, skipping")
+                self.skipped += 1
+                continue
+            self.counts[kind] += 1
+
+        self.elapsed = loop.time() - start
+        logging.info(f"Replay of {self.path} finished in {round(self.elapsed, 3)}s: "
+                     f"{self.counts[KIND_HASS]} HASS, {self.counts[KIND_MQTT]} MQTT, "
+                     f"{self.counts[KIND_SENSE]} Sense records ({self.skipped} skipped)")
+        return self.counts
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,117 @@
+# Copyright 2022, Charles Powell
+import logging
+
+from .data_source import AggregateSource, DerivedSource
+
+
+class PlugRegistry:
+    # Single store for all plug instances, indexed by identifier and MAC. Indexes are maintained as plugs
+    # are added and removed, so lookups never need to scan all plugs.
+    def __init__(self):
+        # MAC to plug, in the order plugs were added. This dict is shared with the Sense responders,
+        # so it is only ever updated in place.
+        self.by_mac = {}
+        self.by_identifier = {}
+
+    def __len__(self):
+        return len(self.by_mac)
+
+    def __iter__(self):
+        return iter(self.by_mac.values())
+
+    def __contains__(self, key):
+        return key in self.by_identifier or key in self.by_mac
+
+    def add(self, plug):
+        if plug.mac in self.by_mac:
+            # Assertion error - can't use the same MAC twice!
+            raise AssertionError(f"Configuration Error: Two plugs configured with the same MAC address! "
+                                 f"({self.by_mac[plug.mac].identifier}, {plug.identifier})")
+        self.by_mac[plug.mac] = plug
+
+        if plug.identifier in self.by_identifier:
+            logging.warning(f"Multiple plugs configured with identifier {plug.identifier}, lookups by identifier "
+                            f"will use the first one")
+        else:
+            self.by_identifier[plug.identifier] = plug
+        self.attach_source(plug.data_source)
+
+    def add_all(self, plugs):
+        for plug in plugs:
+            self.add(plug)
+
+    def remove(self, key):
+        # Remove a plug by identifier or MAC, returning it (or None if not found)
+        plug = self.get(key)
+        if plug is None:
+            return None
+        # Derived plug formulas can't be evaluated without their inputs
+        dependents = [other.identifier for other in self.by_mac.values()
+                      if isinstance(other.data_source, DerivedSource)
+                      and any(p is plug for _, p in other.data_source.inputs)]
+        if dependents:
+            raise AssertionError(f"Configuration Error: Plug {plug.identifier} can't be removed, it is an input "
+                                 f"of Derived plug(s) {', '.join(dependents)}")
+        del self.by_mac[plug.mac]
+        if self.by_identifier.get(plug.identifier) is plug:
+            del self.by_identifier[plug.identifier]
+
+        ds = plug.data_source
+        if ds is not None and ds.observers:
+            # Stop observing input sources on behalf of subscribers of the removed plug
+            for source in ds.input_sources():
+                source.remove_observer(ds.input_changed)
+        if isinstance(ds, AggregateSource):
+            # Elements are reported individually again
+            for element in ds.elements:
+                element.in_aggregate = False
+            ds.elements = []
+        if plug.in_aggregate:
+            # Removal is rare, so the Aggregate is found by scanning rather than kept in an index
+            for other in self.by_mac.values():
+                aggregate = other.data_source
+                if isinstance(aggregate, AggregateSource) and plug in aggregate.elements:
+                    aggregate.elements.remove(plug)
+                    if aggregate.observers:
+                        ds.remove_observer(aggregate.input_changed)
+                    break
+
+        self.detach_source(ds)
+        return plug
+
+    @staticmethod
+    def attach_source(ds):
+        # Have the data source's controller route updates to it, including while already running
+        if ds is not None and ds.controller is not None:
+            ds.controller.add_source(ds)
+
+    @staticmethod
+    def detach_source(ds):
+        # Stop the data source's controller from routing updates to it
+        if ds is not None and ds.controller is not None:
+            ds.controller.remove_source(ds)
+
+    def get(self, key):
+        # Get plug by identifier or MAC, returning None if not found
+        plug = self.by_identifier.get(key)
+        if plug is None:
+            plug = self.by_mac.get(key)
+        return plug
+
+    def set_elements(self, aggregate, element_ids):
+        # Resolve element identifiers to plugs, and assign them to the Aggregate plug
+        elements = []
+        for element_id in element_ids:
+            plug = self.by_identifier.get(element_id)
+            if plug is None:
+                logging.warning(f"Aggregate {aggregate.identifier} element {element_id} not found, ignoring")
+                continue
+            # Check if this plug is already in another aggregate
+            if plug.in_aggregate:
+                logging.warning(f"Configuration adds plug {plug.identifier} to more than one Aggregate"
+                                f" plug. Usage in Aggregate {aggregate.identifier} will be ignored.")
+                continue
+            elements.append(plug)
+            plug.in_aggregate = True
+        aggregate.data_source.elements = elements
+        return elements
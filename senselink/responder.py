@@ -0,0 +1,167 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+
+from .common import keys_exist, safekey
+from .metrics import LatencyTracker
+from .tplink_encryption import encrypt, decrypt
+
+# Number of slowest plugs to include in slow response breakdowns
+SLOWEST_PLUGS = 3
+
+
+def parse_sense_request(data, addr, timings=None):
+    # Returns the decoded request if it is a Sense emeter request, otherwise None. Time spent
+    # decrypting and parsing is added to the timings dict, if provided.
+    start = time.perf_counter()
+    decrypted_data = decrypt(data)
+    decrypted = time.perf_counter()
+    try:
+        json_data = json.loads(decrypted_data)
+    except ValueError:
+        # Appears to not be JSON
+        logging.debug("Did not receive valid JSON message, ignoring")
+        return None
+    if timings is not None:
+        timings['decrypt'] = decrypted - start
+        timings['json'] = time.perf_counter() - decrypted
+
+    # Sense requests the emeter and system parameters
+    if not isinstance(json_data, dict) or not (keys_exist(json_data, "emeter", "get_realtime")
+                                               and keys_exist(json_data, "system", "get_sysinfo")):
+        logging.debug(f"Ignoring non-emeter JSON from {addr[0]}: {json_data}")
+        return None
+
+    # Check for non-empty values, to prevent echo storms
+    if bool(safekey(json_data, 'emeter/get_realtime')):
+        # This is a self-echo, common with Docker without --net=Host!
+        logging.debug("Ignoring non-empty/non-Sense UDP request")
+        return None
+
+    return json_data
+
+
+def encode_response(response):
+    json_str = json.dumps(response, separators=(',', ':'))
+    encrypted_str = encrypt(json_str)
+    # Strip leading 4 bytes for...some reason
+    return encrypted_str[4:]
+
+
+class ThreadedResponder:
+    # Responds to Sense requests from a dedicated thread, using plug responses prepared ahead of time
+    # on the event loop, so responses aren't delayed by ingest processing
+    recorder = None
+    exporter = None
+    accounting = None
+
+    def __init__(self, instances, port=9999, interval=0.25, latency=None):
+        self.instances = instances
+        self.port = port
+        self.interval = interval
+        self.should_respond = True
+        self.target = None
+
+        # Tuple of (version, entries), replaced as a whole when published
+        self.snapshot = (0, ())
+        self.sock = None
+        self.thread = None
+        self._running = False
+
+        # Reply latency tracking
+        self.latency = latency or LatencyTracker()
+
+    def publish(self):
+        # Build responses for all reported plugs, and swap them in as a new snapshot
+        start = time.perf_counter()
+        entries = []
+        for inst in self.instances.values():
+            if inst.in_aggregate:
+                continue
+            power = inst.power
+            response = inst.generate_response(power)
+            entries.append((inst, power, encode_response(response)))
+        self.snapshot = (self.snapshot[0] + 1, tuple(entries))
+        if self.accounting is not None:
+            # Responses themselves are sent from the responder thread, off the event loop
+            self.accounting.add('sense publish', time.perf_counter() - start)
+
+    async def publish_loop(self):
+        while True:
+            self.publish()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('0.0.0.0', self.port))
+        # Wake periodically to check if we should stop
+        self.sock.settimeout(0.5)
+        self.publish()
+        self._running = True
+        self.thread = threading.Thread(target=self.serve, name='SenseLinkResponder', daemon=True)
+        self.thread.start()
+        logging.info(f"Started UDP responder thread on port {self.port}")
+
+    def stop(self):
+        self._running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def serve(self):
+        while self._running:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError as err:
+                logging.error(f"UDP responder socket error: {err}")
+                continue
+            try:
+                self.handle(data, addr)
+            except Exception as err:
+                logging.error(f"Error responding to request from {addr[0]}: {err}")
+
+    def handle(self, data, addr):
+        received = time.perf_counter()
+        if self.recorder is not None:
+            self.recorder.record_sense(data, addr)
+        timings = {}
+        if parse_sense_request(data, addr, timings) is None:
+            return
+        logging.debug(f"Broadcast received from {self.target or addr[0]}")
+
+        version, entries = self.snapshot
+        send_time = 0.0
+        for inst, power, payload in entries:
+            if not inst.should_respond(power=power):
+                logging.debug(f'Plug {inst.identifier} response rate limited')
+                continue
+            if self.should_respond:
+                send_start = time.perf_counter()
+                self.sock.sendto(payload, addr)
+                send_time += time.perf_counter() - send_start
+            else:
+                logging.debug(f"SENSE_RESPONSE disabled, not sending response for plug {inst.identifier}")
+
+        latency = time.perf_counter() - received
+        timings['send'] = send_time
+        timings['total'] = latency
+        timings['plugs'] = len(entries)
+        self.latency.record(latency, timings)
+
+        if self.exporter is not None:
+            self.exporter.notify_poll(threadsafe=True)
+
+    def stats(self):
+        stats = self.latency.stats()
+        stats['snapshot_version'] = self.snapshot[0]
+        return stats
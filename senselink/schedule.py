@@ -0,0 +1,125 @@
+# Copyright 2022, Charles Powell
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+from .data_source import DataSource
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DAY_GROUPS = {'weekdays': DAYS[:5], 'weekend': DAYS[5:]}
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+
+def parse_time(value):
+    # Seconds since midnight, from 'HH:MM' or 'HH:MM:SS'. YAML (1.1) reads unquoted times like 8:00 as
+    # sexagesimal integers, which are minutes since midnight.
+    if isinstance(value, int):
+        seconds = value * 60
+    else:
+        parts = [int(part) for part in str(value).split(':')]
+        if len(parts) not in (2, 3):
+            raise ValueError(f"invalid time '{value}', expected HH:MM")
+        seconds = parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) == 3 else 0)
+    if not 0 <= seconds < SECONDS_PER_DAY:
+        raise ValueError(f"time '{value}' is outside of a day")
+    return seconds
+
+
+def parse_profile(profile):
+    # Sorted (seconds since midnight, watts) change points, from a mapping (or list of single-entry mappings)
+    # of time to power
+    if isinstance(profile, list):
+        items = [item for entry in profile for item in entry.items()]
+    else:
+        items = profile.items()
+    return sorted((parse_time(key), float(value)) for key, value in items)
+
+
+def parse_date(value):
+    # YAML reads unquoted ISO dates as dates already
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+
+class ScheduleSource(DataSource):
+    # Power follows a daily or weekly timetable of change points. Profiles are compiled at startup into
+    # sorted boundary arrays, and the time of the next change is cached so power reads between changes
+    # don't need a lookup.
+
+    def __init__(self, identifier, details, controller=None):
+        super().__init__(identifier, details, controller)
+        self._value = 0.0
+        self._valid_until = 0.0
+
+        details = details or {}
+        default = float(details.get('default') or 0.0)
+        try:
+            self.compile(details, default)
+        except (ValueError, TypeError, AttributeError) as err:
+            raise AssertionError(f"Configuration Error: Schedule plug {identifier}: {err}")
+
+    def compile(self, details, default):
+        # Profile for each day of the week, weekly entries taking precedence over the daily profile
+        day_profiles = [None] * 7
+        if details.get('daily') is not None:
+            day_profiles = [parse_profile(details['daily'])] * 7
+        for key, profile in (details.get('weekly') or {}).items():
+            key = str(key).lower()
+            days = DAY_GROUPS.get(key) or (key[:3],)
+            for day in days:
+                if day not in DAYS:
+                    raise ValueError(f"unknown weekday '{key}'")
+                day_profiles[DAYS.index(day)] = parse_profile(profile)
+
+        # Flatten to change points over the week. Before the first change point, the last value of the
+        # week carries over (so e.g. a heater turned on at 22:00 stays on overnight).
+        points = []
+        for day, profile in enumerate(day_profiles):
+            points.extend((day * SECONDS_PER_DAY + seconds, watts) for seconds, watts in (profile or ()))
+        if not points:
+            points = [(0, default)]
+        self._boundaries = [seconds for seconds, _ in points]
+        self._values = [watts for _, watts in points]
+
+        # Holiday dates follow the holiday profile (by default, the default power all day). Before its
+        # first change point, the regular schedule applies.
+        self.holidays = {parse_date(value) for value in (details.get('holidays') or ())}
+        holiday_points = parse_profile(details.get('holiday') or {0: default})
+        self._holiday_boundaries = [seconds for seconds, _ in holiday_points]
+        self._holiday_values = [watts for _, watts in holiday_points]
+
+    def value_at(self, moment):
+        # Scheduled power at a (local, naive) datetime, and the datetime it next changes
+        midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        day_offset = (moment - midnight).total_seconds()
+        offset = moment.weekday() * SECONDS_PER_DAY + day_offset
+
+        index = bisect_right(self._boundaries, offset)
+        value = self._values[index - 1]
+        if index < len(self._boundaries):
+            next_offset = self._boundaries[index]
+        else:
+            next_offset = self._boundaries[0] + SECONDS_PER_WEEK
+        next_change = midnight + timedelta(seconds=next_offset - moment.weekday() * SECONDS_PER_DAY)
+
+        if self.holidays:
+            if moment.date() in self.holidays:
+                index = bisect_right(self._holiday_boundaries, day_offset)
+                if index > 0:
+                    value = self._holiday_values[index - 1]
+                    next_change = midnight + timedelta(days=1)
+                if index < len(self._holiday_boundaries):
+                    next_change = min(next_change, midnight + timedelta(seconds=self._holiday_boundaries[index]))
+            # Check again at midnight, in case tomorrow is a holiday
+            next_change = min(next_change, midnight + timedelta(days=1))
+        return value, next_change
+
+    @property
+    def power(self):
+        now = time.time()
+        if now >= self._valid_until:
+            self._value, next_change = self.value_at(datetime.fromtimestamp(now))
+            self._valid_until = next_change.timestamp()
+        return self._value
@@ -5,32 +5,54 @@ import asyncio
 import argparse
 import logging
 import dpath.util
-import json
+import threading
+import time
 
 from .common import *
 from .data_source import *
 from .plug_instance import *
 from .tplink_encryption import *
+from .recorder import TrafficRecorder, TrafficReplayer
+from .planner import AggregatePlanner
+from .responder import ThreadedResponder, parse_sense_request, encode_response, SLOWEST_PLUGS
+from .metrics import LatencyTracker
+from .control import ControlServer
+from .exporter import PowerExporter
+from .monitor import LoopMonitor
+from .schedule import ScheduleSource
+from .events import PowerSubscription
+from .accounting import TimeAccounting
+from .registry import PlugRegistry
+from .formula import find_cycle
 
 from senselink.mqtt import *
 from senselink.homeassistant import *
+from senselink.udp import *
 
 STATIC_KEY = 'static'
 MUTABLE_KEY = 'mutable'
+SCHEDULE_KEY = 'schedule'
 HASS_KEY = 'hass'
 MQTT_KEY = 'mqtt'
+UDP_KEY = 'udp'
 AGG_KEY = 'aggregate'
+AUTO_AGG_KEY = 'auto_aggregate'
+DERIVED_KEY = 'derived'
 PLUGS_KEY = 'plugs'
 
 
 class SenseLinkProtocol(asyncio.DatagramProtocol):
     transport = None
     target = None
+    recorder = None
+    exporter = None
+    accounting = None
 
-    def __init__(self, instances, finished):
+    def __init__(self, instances, finished, latency=None):
         self._instances = instances
         self.should_respond = True
         self.finished = finished
+        self.latency = latency or LatencyTracker()
 
     def connection_made(self, transport):
         self.transport = transport
@@ -39,58 +61,70 @@ class SenseLinkProtocol(asyncio.DatagramProtocol):
         pass
 
     def datagram_received(self, data, addr):
-        # Decrypt request data
-        decrypted_data = decrypt(data)
+        received = time.perf_counter()
+        if self.recorder is not None:
+            self.recorder.record_sense(data, addr)
+        # Decrypt and check request data
+        timings = {}
+        json_data = parse_sense_request(data, addr, timings)
+        if json_data is None:
+            return
         # Determine target
         request_addr = self.target or addr[0]
-
-        try:
-            # Get JSON data
-            json_data = json.loads(decrypted_data)
-
-            # Sense requests the emeter and system parameters
-            if keys_exist(json_data, "emeter", "get_realtime") and keys_exist(json_data, "system", "get_sysinfo"):
-                # Check for non-empty values, to prevent echo storms
-                if bool(safekey(json_data, 'emeter/get_realtime')):
-                    # This is a self-echo, common with Docker without --net=Host!
-                    logging.debug("Ignoring non-empty/non-Sense UDP request")
-                    return
-
-                logging.debug(f"Broadcast received from {request_addr}: {json_data}")
-
-                # Build and send responses
-                for inst in self._instances.values():
-                    # Check if this instance is in an aggregate
-                    if inst.in_aggregate:
-                        # Do not send individual response for this plug
-                        logging.debug(f"Plug '{inst.identifier}' in aggregate, not sending discrete response")
-                        continue
-
-                    # Build response
-                    response = inst.generate_response()
-                    json_str = json.dumps(response, separators=(',', ':'))
-                    encrypted_str = encrypt(json_str)
-                    # Strip leading 4 bytes for...some reason
-                    trun_str = encrypted_str[4:]
-
-                    # Allow disabling response, and rate limiting
-                    plug_respond = inst.should_respond()
-                    if self.should_respond and plug_respond:
-                        # Send response
-                        logging.debug(f"Sending response for plug {inst.identifier}: {response}")
-                        self.transport.sendto(trun_str, addr)
-                    elif not plug_respond:
-                        logging.debug(f'Plug {inst.identifier} response rate limited')
-                    else:
-                        # Do not send response, but log for debugging
-                        logging.debug(
-                            f"SENSE_RESPONSE disabled, plug {inst.identifier} response content would be: {response}")
+        logging.debug(f"Broadcast received from {request_addr}: {json_data}")
+
+        # Build and send responses
+        build_time = 0.0
+        send_time = 0.0
+        plug_times = []
+        for inst in self._instances.values():
+            # Check if this instance is in an aggregate
+            if inst.in_aggregate:
+                # Do not send individual response for this plug
+                logging.debug(f"Plug '{inst.identifier}' in aggregate, not sending discrete response")
+                continue
+
+            # Allow rate limiting, before building response
+            build_start = time.perf_counter()
+            power = inst.power if inst.suppress_unchanged else None
+            if not inst.should_respond(power=power):
+                logging.debug(f'Plug {inst.identifier} response rate limited')
+                continue
+
+            # Build response
+            response = inst.generate_response(power)
+            trun_str = encode_response(response)
+            send_start = time.perf_counter()
+            build_time += send_start - build_start
+            plug_times.append((send_start - build_start, inst.identifier))
+
+            # Allow disabling response
+            if self.should_respond:
+                # Send response
+                logging.debug(f"Sending response for plug {inst.identifier}: {response}")
+                self.transport.sendto(trun_str, addr)
+                send_time += time.perf_counter() - send_start
             else:
-                logging.debug(f"Ignoring non-emeter JSON from {request_addr}: {json_data}")
-
-        # Appears to not be JSON
-        except ValueError:
-            logging.debug("Did not receive valid JSON message, ignoring")
+                # Do not send response, but log for debugging
+                logging.debug(
+                    f"SENSE_RESPONSE disabled, plug {inst.identifier} response content would be: {response}")
+
+        latency = time.perf_counter() - received
+        timings['build'] = build_time
+        timings['send'] = send_time
+        timings['total'] = latency
+        timings['plugs'] = len(plug_times)
+        if self.latency.slo is not None and latency > self.latency.slo:
+            # Only determine the slowest plugs when needed
+            plug_times.sort(reverse=True)
+            timings['slowest'] = [(plug_id, t) for t, plug_id in plug_times[:SLOWEST_PLUGS]]
+        self.latency.record(latency, timings)
+        if self.accounting is not None:
+            self.accounting.add('sense', latency)
+
+        if self.exporter is not None:
+            # Sample reported values after this callback, so exporting doesn't delay responses
+            self.exporter.notify_poll()
 
 
 class SenseLink:
@@ -104,16 +138,49 @@ class SenseLink:
         self.port = port
         self.target = None
         self.server_task = None
-        self.instances = {}
-        self._agg_instances = {}
+        self.registry = PlugRegistry()
+        # Plugs by MAC, kept for compatibility (same dict as the registry index)
+        self.instances = self.registry.by_mac
         self.tasks = set()
+        self.hass_controllers = []
+        self.mqtt_controllers = []
+        self._mqtt_pool = {}
+        self.udp_controllers = []
+        self._udp_pool = {}
+        self.recorder = None
+        self.event_loop = None
+        self.responder_thread = False
+        self.snapshot_interval = 0.25
+        self.responder = None
+        self.latency = LatencyTracker()
+        self.loop = None
+        self.control_server = None
+        self.exporter = None
+        self.loop_monitor = None
+        self.accounting = None
+        # Power updates queued from other threads
+        self._pending_updates = {}
+        self._pending_lock = threading.Lock()
 
     def create_instances(self):
         config = yaml.load(self.config, Loader=yaml.FullLoader)
         logging.debug(f"Configuration loaded: {config}")
         sources = config.get('sources')
         self.target = config.get('target') or None
+        record_path = config.get('record') or None
+        self.event_loop = config.get('event_loop') or None
+        self.responder_thread = config.get('responder_thread') or False
+        control = config.get('control') or None
+        export = config.get('export') or None
+        loop_monitor = config.get('loop_monitor') or None
+        accounting = config.get('accounting') or None
+        latency_slo = config.get('latency_slo_ms') or None
+        self.latency.slo = latency_slo / 1000 if latency_slo is not None else None
+        self.snapshot_interval = config.get('snapshot_interval') or 0.25
         aggregate = None
+        auto_aggregate = None
+        derived_instances = {}
+        mqtt_publish = []
 
         for source in sources:
             # Get specified identifier
@@ -142,6 +209,18 @@ class SenseLink:
                 instances = PlugInstance.configure_plugs(plugs, MutableSource)
                 self.add_instances(instances)
 
+            # Timetable plugs
+            elif source_id.lower() == SCHEDULE_KEY:
+                schedule = source[SCHEDULE_KEY]
+                if schedule is None:
+                    logging.error(f"Configuration error for Source {source_id}")
+                    continue
+                # Generate plug instances
+                plugs = schedule[PLUGS_KEY]
+                logging.info("Generating Schedule instances")
+                instances = PlugInstance.configure_plugs(plugs, ScheduleSource)
+                self.add_instances(instances)
+
             # HomeAssistant Plugs, using Websockets datasource
             elif source_id.lower() == HASS_KEY:
                 # Configure this HASS Data source
@@ -151,7 +230,14 @@ class SenseLink:
                 url = hass['url']
                 auth_token = hass['auth_token']
                 max_message_size = hass.get('max_message_size') or None
-                hass_controller = HAController(url, auth_token, max_ws_message_size=max_message_size)
+                entity_subscription = hass.get('entity_subscription', True)
+                hass_controller = HAController(url, auth_token, max_ws_message_size=max_message_size,
+                                               entity_subscription=entity_subscription,
+                                               reconnect_min=hass.get('reconnect_min') or 2.0,
+                                               reconnect_max=hass.get('reconnect_max') or 300.0,
+                                               stale_timeout=hass.get('stale_timeout') or None,
+                                               streaming_parse=hass.get('streaming_parse') or False)
+                self.hass_controllers.append(hass_controller)
 
                 # Generate plug instances
                 plugs = hass[PLUGS_KEY]
@@ -173,17 +259,60 @@ class SenseLink:
                 port = mqtt_conf.get('port') or 1883
                 username = mqtt_conf.get('username') or None
                 password = mqtt_conf.get('password') or None
-                mqtt_cont = MQTTController(host, port, username, password)
+
+                # Share one connection between sources using the same broker and user
+                pool_key = (host, port, username)
+                mqtt_cont = self._mqtt_pool.get(pool_key)
+                if mqtt_cont is None:
+                    mqtt_cont = MQTTController(host, port, username, password,
+                                               coalesce=mqtt_conf.get('coalesce') or False)
+                    self._mqtt_pool[pool_key] = mqtt_cont
+                    self.mqtt_controllers.append(mqtt_cont)
+                    # Start controller
+                    mqtt_task = mqtt_cont.connect()
+                    self.tasks.add(mqtt_task)
+                else:
+                    logging.info(f"Reusing existing MQTT connection to {mqtt_cont.broker}")
+                    if password != mqtt_cont.password:
+                        logging.warning(f"MQTT source for {mqtt_cont.broker} uses a different password than a prior "
+                                        f"source with the same user, using the first password provided")
+                    if (mqtt_conf.get('coalesce') or False) != mqtt_cont.coalesce:
+                        logging.warning(f"MQTT source for {mqtt_cont.broker} sets coalesce differently than a prior "
+                                        f"source with the same user, using the first setting provided")
 
                 # Generate plug instances
-                plugs = mqtt_conf[PLUGS_KEY]
+                plugs = mqtt_conf.get(PLUGS_KEY) or []
                 logging.info("Generating MQTT instances")
                 instances = PlugInstance.configure_plugs(plugs, MQTTSource, mqtt_cont)
                 self.add_instances(instances)
 
-                # Start controller
-                mqtt_task = mqtt_cont.connect()
-                self.tasks.add(mqtt_task)
+                if mqtt_conf.get('publish') is not None:
+                    # Publishers are created once all plugs are defined
+                    mqtt_publish.append((mqtt_cont, mqtt_conf['publish']))
+
+            # UDP Plugs, with readings pushed directly by devices
+            elif source_id.lower() == UDP_KEY:
+                udp_conf = source[UDP_KEY]
+                if udp_conf is None or udp_conf.get('port') is None:
+                    logging.error(f"Configuration error for Source {source_id}, port must be specified")
+                    continue
+                host = udp_conf.get('host') or '0.0.0.0'
+                port = udp_conf['port']
+
+                # Share one socket between sources using the same port
+                udp_cont = self._udp_pool.get((host, port))
+                if udp_cont is None:
+                    udp_cont = UDPController(port, host)
+                    self._udp_pool[(host, port)] = udp_cont
+                    self.udp_controllers.append(udp_cont)
+                    # Start controller
+                    self.tasks.add(udp_cont.connect())
+
+                # Generate plug instances
+                plugs = udp_conf[PLUGS_KEY]
+                logging.info("Generating UDP instances")
+                instances = PlugInstance.configure_plugs(plugs, UDPSource, udp_cont)
+                self.add_instances(instances)
 
             # Aggregate-type Plugs
             elif source_id.lower() == AGG_KEY:
@@ -196,6 +325,26 @@ class SenseLink:
                     continue
                 self.has_aggregate = True
                 aggregate = source[AGG_KEY]
+
+            # Plugs derived from other plugs by a formula
+            elif source_id.lower() == DERIVED_KEY:
+                derived = source[DERIVED_KEY]
+                if derived is None:
+                    logging.error(f"Configuration error for Source {source_id}")
+                    continue
+                # Generate plug instances, inputs are resolved once all plugs are defined
+                plugs = derived[PLUGS_KEY]
+                logging.info("Generating Derived instances")
+                instances = PlugInstance.configure_plugs(plugs, DerivedSource)
+                self.add_instances(instances)
+                derived_instances.update(instances)
+
+            # Automatically planned Aggregate plugs
+            elif source_id.lower() == AUTO_AGG_KEY:
+                auto_aggregate = source[AUTO_AGG_KEY]
+                if auto_aggregate is None or auto_aggregate.get('max_plugs') is None:
+                    logging.error(f"Configuration error for Source {source_id}, max_plugs must be specified")
+                    auto_aggregate = None
             else:
                 logging.error(f"Source type '{source_id}' not recognized")
 
@@ -206,65 +355,290 @@ class SenseLink:
             logging.info("Generating Aggregate instances")
             instances = PlugInstance.configure_plugs(plugs, AggregateSource)
             for inst in instances.values():
-                # Grab data source for this instance
-                ag_ds = inst.data_source
-                # So that we can get the element IDs (i.e. plug_id's)
-                element_ids = ag_ds.element_ids
-                # Use those element_ids to get actual instances from global instance dict
-                elements = []
-                for plug in self.instances.values():
-                    if plug.identifier in element_ids:
-                        # Check if this plug is already in another aggregate
-                        if plug.in_aggregate:
-                            logging.warning(f"""Configuration adds plug {plug.identifier} to more than one Aggregate"""
-                                            f""" plug. Usage in Aggregate {inst.identifier} will be ignored.""")
-                            continue
-                        # We want this plug
-                        elements.append(plug)
-                        plug.in_aggregate = True
-                # Pass these elements (top-level plugs) back to Aggregate data source
-                ag_ds.elements = elements
+                # Use the element IDs (i.e. plug_id's) to get actual instances from the registry
+                self.registry.set_elements(inst, inst.data_source.element_ids)
             # Add these aggregate plugs to the instance list
             self.add_instances(instances)
 
+        if derived_instances:
+            self.resolve_derived(derived_instances.values())
+
+        if auto_aggregate is not None:
+            # Group remaining plugs as needed to stay within the plug budget
+            planner = AggregatePlanner(auto_aggregate['max_plugs'])
+            groups = planner.plan(list(self.instances.values()))
+            instances = planner.create_instances(groups, self.instances.keys())
+            self.add_instances(instances)
+
+        for mqtt_cont, publish in mqtt_publish:
+            self.create_mqtt_publisher(mqtt_cont, publish)
+
+        if record_path is not None:
+            self.record_traffic(record_path)
+
+        if control is not None:
+            # Local control server, for updating Mutable plugs from other processes
+            if control.get('socket') is None and control.get('port') is None:
+                logging.error("Configuration error for control server, socket or port must be specified")
+            else:
+                self.control_server = ControlServer(self, socket_path=control.get('socket'),
+                                                    host=control.get('host') or '127.0.0.1',
+                                                    port=control.get('port'))
+                self.tasks.add(self.control_server.start())
+
+        if export is not None:
+            # Export reported plug power values
+            if export.get('path') is None and export.get('target') is None:
+                logging.error("Configuration error for export, path or target must be specified")
+            else:
+                self.exporter = PowerExporter(self.instances, path=export.get('path'),
+                                              fmt=export.get('format') or 'influx',
+                                              mode=export.get('mode') or 'broadcast',
+                                              flush_interval=export.get('flush_interval') or 10.0,
+                                              max_bytes=export.get('max_bytes') or 10 * 2 ** 20,
+                                              backups=export.get('backups') or 3,
+                                              target=export.get('target'),
+                                              measurement=export.get('measurement') or 'senselink')
+                self.tasks.add(self.exporter.run())
+
+        if loop_monitor is not None:
+            # Event loop lag measurement and stall attribution
+            options = loop_monitor if isinstance(loop_monitor, dict) else {}
+            self.loop_monitor = LoopMonitor(interval=options.get('interval') or 0.1,
+                                            threshold=(options.get('threshold_ms') or 100) / 1000)
+            self.tasks.add(self.loop_monitor.run())
+
+        if accounting is not None:
+            # Event loop time used by each part of SenseLink
+            options = accounting if isinstance(accounting, dict) else {}
+            window = options.get('window') or 60.0
+            self.enable_accounting(window, options.get('log_interval', window * 5))
+            self.tasks.add(self.accounting.run())
+
+    def resolve_derived(self, instances):
+        # Connect Derived plugs to their input plugs, and check that no formulas depend on each other in a cycle
+        for inst in instances:
+            ds = inst.data_source
+            inputs = []
+            for name, plug_id in ds.input_ids.items():
+                plug = self.registry.by_identifier.get(plug_id)
+                if plug is None:
+                    raise AssertionError(f"Configuration Error: Derived plug {inst.identifier} formula input "
+                                         f"{plug_id} is not a defined plug")
+                inputs.append((name, plug))
+            ds.inputs = tuple(inputs)
+
+        # Aggregates can include Derived plugs, so include their elements as dependencies too
+        graph = {}
+        for plug in self.registry:
+            ds = plug.data_source
+            if isinstance(ds, DerivedSource):
+                graph[plug.identifier] = [p.identifier for _, p in ds.inputs]
+            elif isinstance(ds, AggregateSource):
+                graph[plug.identifier] = [p.identifier for p in ds.elements]
+        cycle = find_cycle(graph)
+        if cycle is not None:
+            raise AssertionError(f"Configuration Error: Derived plug formulas depend on each other in a cycle "
+                                 f"({' -> '.join(cycle)})")
+
+    def enable_accounting(self, window=60.0, log_interval=None):
+        self.accounting = TimeAccounting(window, log_interval)
+        # Create table entries up front
+        self.accounting.register('sense')
+        for controller in self.hass_controllers:
+            controller.accounting = self.accounting
+            self.accounting.register(f'hass {controller.url}')
+        for controller in self.mqtt_controllers:
+            controller.accounting = self.accounting
+            self.accounting.register(f'mqtt {controller.broker}')
+        for controller in self.udp_controllers:
+            controller.accounting = self.accounting
+            self.accounting.register(f'udp {controller.host}:{controller.port}')
+        for inst in self.registry:
+            if inst.data_source.controller is not None:
+                self.accounting.register(f'plug {inst.identifier}')
+        if self.control_server is not None:
+            self.accounting.register('control')
+        if self.exporter is not None:
+            self.exporter.accounting = self.accounting
+            self.accounting.register('export')
+        if self.protocol is not None:
+            self.protocol.accounting = self.accounting
+        if self.responder is not None:
+            self.responder.accounting = self.accounting
+
+    def create_mqtt_publisher(self, mqtt_cont, publish):
+        # Publish plug power values (by default, of all plugs) over an MQTT connection
+        if publish.get('plugs') is not None:
+            plugs = []
+            for key in publish['plugs']:
+                plug = self.registry.get(key)
+                if plug is None:
+                    logging.warning(f"No plug found for '{key}', not publishing to MQTT")
+                    continue
+                plugs.append(plug)
+        else:
+            plugs = list(self.registry)
+        publisher = MQTTPublisher(mqtt_cont, plugs, topic=publish.get('topic') or 'senselink/{plug}/power',
+                                  deadband=publish.get('deadband') or 0.0,
+                                  min_interval=publish.get('min_interval') or 0.0,
+                                  retain=publish.get('retain') or False,
+                                  qos=publish.get('qos') or 0)
+        self.tasks.add(publisher.run())
+        logging.info(f"Publishing power for {len(plugs)} plugs to MQTT broker {mqtt_cont.broker}")
+
     def add_instances(self, instances):
-        if instances is PlugInstance:
+        if isinstance(instances, PlugInstance):
             # Single plug
-            p_i = instances
-            self.instances.update({p_i.identifier: p_i})
-        elif all(isinstance(p, PlugInstance) for p in instances):
-            # List of plugs, convert to dict and add to storage
-            new_instances = {p_i.identifier: p_i for p_i in instances}
-            self.instances = {**self.instances, **new_instances}
+            self.registry.add(instances)
+        elif isinstance(instances, dict):
+            # Dict of plugs, keyed by MAC
+            self.registry.add_all(instances.values())
         else:
-            # Assume Dict of plugs
-            # Check for duplicated MAC
-            union_macs = [val for val in instances.keys() if val in self.instances.keys()]
-            if any(union_macs):
-                # Assertion error - can't use the same MAC twice!
-                raise AssertionError(
-                    f"Configuration Error: Two plugs configured with the same MAC address! ({union_macs})")
+            # List of plugs
+            self.registry.add_all(instances)
 
-            # Add to global instances
-            self.instances = {**self.instances, **instances}
+    def remove_instance(self, key):
+        # Remove a plug by identifier or MAC, returning the removed plug (or None if not found)
+        return self.registry.remove(key)
 
     def plug_for_mac(self, mac):
-        return self.instances[mac]
+        return self.registry.by_mac[mac]
+
+    def plug_for_id(self, identifier):
+        return self.registry.by_identifier[identifier]
+
+    def plug(self, key):
+        # Get plug by identifier or MAC, returning None if not found
+        return self.registry.get(key)
+
+    def update_powers(self, updates):
+        # Update power values of Mutable plugs, from a dict keyed by plug identifier or MAC.
+        # Must be called from the event loop, see update_powers_threadsafe() otherwise.
+        updated = 0
+        for key, power in updates.items():
+            inst = self.registry.get(key)
+            if inst is None:
+                logging.warning(f"No plug found for '{key}', ignoring power update")
+                continue
+            if not isinstance(inst.data_source, MutableSource):
+                logging.warning(f"Plug {inst.identifier} is not a Mutable plug, ignoring power update")
+                continue
+            inst.data_source.power = power
+            updated += 1
+        return updated
+
+    def subscribe(self, plugs=None, threshold=0.0, max_queue=100):
+        # Async iterator of PowerChange events for the given plugs (identifiers or MACs), or all plugs. Use as
+        # 'async with senselink.subscribe(...) as changes: async for change in changes:' to stop observing
+        # when done, or call close() on the returned subscription.
+        if plugs is None:
+            instances = list(self.registry)
+        else:
+            instances = []
+            for key in plugs:
+                inst = self.registry.get(key)
+                if inst is None:
+                    raise KeyError(f"No plug found for '{key}'")
+                instances.append(inst)
+        return PowerSubscription(instances, threshold, max_queue)
+
+    def update_powers_threadsafe(self, updates):
+        # Queue power updates from another thread, to be applied on the event loop as a single batch.
+        # Updates for the same plug made before the batch is applied are coalesced (latest value wins).
+        if self.loop is None:
+            raise RuntimeError("SenseLink server must be started before updating from other threads")
+        with self._pending_lock:
+            schedule = not self._pending_updates
+            self._pending_updates.update(updates)
+        if schedule:
+            self.loop.call_soon_threadsafe(self.apply_pending_updates)
+
+    def apply_pending_updates(self):
+        with self._pending_lock:
+            updates = self._pending_updates
+            self._pending_updates = {}
+        self.update_powers(updates)
+
+    def hass_stats(self):
+        # Connection statistics for each HASS controller, by URL
+        return {c.url: c.stats() for c in self.hass_controllers}
+
+    def mqtt_stats(self):
+        # Connection and message statistics for each (pooled) MQTT connection
+        return {c.broker: c.stats() for c in self.mqtt_controllers}
+
+    def udp_stats(self):
+        # Reading statistics for each UDP ingest socket
+        return {f'{c.host}:{c.port}': c.stats() for c in self.udp_controllers}
+
+    def response_stats(self):
+        # Response and suppression counts for each plug, by identifier
+        return {inst.identifier: inst.response_stats for inst in self.instances.values()}
 
     def print_instance_wattages(self):
-        for inst in self.instances:
+        for inst in self.registry:
             logging.info(f"Plug {inst.identifier} power: {inst.power}")
 
+    def record_traffic(self, path):
+        # Record incoming HASS, MQTT, and Sense traffic for later replay
+        self.recorder = TrafficRecorder(path)
+        for controller in self.hass_controllers + self.mqtt_controllers:
+            controller.recorder = self.recorder
+        if self.protocol is not None:
+            self.protocol.recorder = self.recorder
+        if self.responder is not None:
+            self.responder.recorder = self.recorder
+
+    def stop_recording(self):
+        if self.recorder is None:
+            return
+        for controller in self.hass_controllers + self.mqtt_controllers:
+            controller.recorder = None
+        if self.protocol is not None:
+            self.protocol.recorder = None
+        if self.responder is not None:
+            self.responder.recorder = None
+        self.recorder.close()
+        self.recorder = None
+
+    async def replay_traffic(self, path, speed=1.0):
+        # Feed recorded traffic back through the controllers and a (network-less) protocol instance
+        loop = asyncio.get_running_loop()
+        protocol = SenseLinkProtocol(self.instances, loop.create_future(), self.latency)
+        protocol.should_respond = self.should_respond
+        protocol.target = self.target
+        protocol.accounting = self.accounting
+        self.protocol = protocol
+
+        for controller in self.mqtt_controllers:
+            controller.build_listeners()
+
+        replayer = TrafficReplayer(path, speed)
+        await replayer.replay(
+            hass_controllers={c.url: c for c in self.hass_controllers},
+            mqtt_controllers={c.broker: c for c in self.mqtt_controllers},
+            protocol=protocol)
+        return replayer
+
     async def start(self):
         self.tasks.add(self.server_start())
         await asyncio.gather(*self.tasks)
 
     async def server_start(self):
+        self.loop = asyncio.get_running_loop()
+        if self.responder_thread:
+            await self.threaded_server_start()
+            return
+
         loop = asyncio.get_running_loop()
         finished = loop.create_future()
-        protocol = SenseLinkProtocol(self.instances, finished)
+        protocol = SenseLinkProtocol(self.instances, finished, self.latency)
         protocol.should_respond = self.should_respond
         protocol.target = self.target
+        protocol.recorder = self.recorder
+        protocol.exporter = self.exporter
+        protocol.accounting = self.accounting
 
         logging.info("Starting UDP server")
         try:
@@ -282,6 +656,49 @@ class SenseLink:
         finally:
             self.transport.close()
 
+    async def threaded_server_start(self):
+        # Respond from a dedicated thread, with plug values published from this loop
+        self.responder = ThreadedResponder(self.instances, self.port, self.snapshot_interval, self.latency)
+        self.responder.should_respond = self.should_respond
+        self.responder.target = self.target
+        self.responder.recorder = self.recorder
+        self.responder.exporter = self.exporter
+        self.responder.accounting = self.accounting
+
+        logging.info("Starting UDP responder thread")
+        try:
+            self.responder.start()
+        except OSError as err:
+            logging.error(f'Error creating responder socket {err}')
+            return
+
+        try:
+            await self.responder.publish_loop()
+        finally:
+            # The responder thread can take up to its socket timeout to notice, so wait for it off the loop
+            await asyncio.get_running_loop().run_in_executor(None, self.responder.stop)
+
+    def latency_stats(self):
+        # Rolling response latency percentiles [seconds], and breakdown of the last SLO violation
+        return self.latency.stats()
+
+    def loop_lag_stats(self):
+        # Event loop lag histogram and last stall attribution, or None if not monitoring
+        if self.loop_monitor is None:
+            return None
+        return self.loop_monitor.stats()
+
+    def loop_time_stats(self):
+        # Cumulative and rolling event loop time [seconds] by subsystem and plug, or None if not enabled
+        if self.accounting is None:
+            return None
+        return self.accounting.stats()
+
+    def responder_stats(self):
+        if self.responder is None:
+            return None
+        return self.responder.stats()
+
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,2 @@
+from .udp_controller import UDPController
+from .udp_data_source import UDPSource
@@ -0,0 +1,148 @@
+# Copyright 2022, Charles Powell
+
+import asyncio
+import logging
+import struct
+import time
+
+# Binary datagrams start with this magic, followed by any number of records
+BINARY_MAGIC = b'SL'
+# Binary record: uint16 plug ID, float32 watts (network byte order)
+BINARY_RECORD = struct.Struct('!Hf')
+
+
+class UDPController(asyncio.DatagramProtocol):
+    # Receives power readings pushed by devices as UDP datagrams, in either format:
+    #   - Text: one or more 'id=watts' readings, separated by newlines, spaces, or commas
+    #   - Binary: BINARY_MAGIC followed by packed BINARY_RECORD readings
+    # Each datagram is handled as a batch, with readings applied in order (so the last reading for a plug wins).
+    transport = None
+    accounting = None
+
+    def __init__(self, port, host='0.0.0.0'):
+        self.host = host
+        self.port = port
+        self.data_sources = []
+        # Reading ID (bytes for text, int for binary) to data sources
+        self.text_index = {}
+        self.binary_index = {}
+
+        # Statistics
+        self.datagram_count = 0
+        self.reading_count = 0
+        self.unknown_count = 0
+        self.malformed_count = 0
+
+    def build_index(self):
+        self.text_index = {}
+        self.binary_index = {}
+        for ds in self.data_sources:
+            self.index_source(ds)
+
+    def index_source(self, ds):
+        sources = self.text_index.setdefault(ds.udp_id.encode(), [])
+        if ds not in sources:
+            sources.append(ds)
+        if ds.binary_id is not None:
+            sources = self.binary_index.setdefault(ds.binary_id, [])
+            if ds not in sources:
+                sources.append(ds)
+
+    def add_source(self, ds):
+        # Route readings to a data source added at runtime
+        if ds not in self.data_sources:
+            self.data_sources.append(ds)
+        self.index_source(ds)
+
+    def remove_source(self, ds):
+        # Stop routing readings to the data source
+        if ds in self.data_sources:
+            self.data_sources.remove(ds)
+        for index in (self.text_index, self.binary_index):
+            for sources in index.values():
+                if ds in sources:
+                    sources.remove(ds)
+
+    async def connect(self):
+        self.build_index()
+        loop = asyncio.get_running_loop()
+        logging.info(f"Listening for UDP power readings on {self.host}:{self.port}")
+        try:
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=(self.host, self.port))
+        except OSError as err:
+            logging.error(f"Error creating UDP ingest endpoint on port {self.port}: {err}")
+            return
+        try:
+            # Run until cancelled
+            await loop.create_future()
+        finally:
+            self.transport.close()
+
+    def datagram_received(self, data, addr):
+        self.datagram_count += 1
+        start = time.perf_counter()
+        if data[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+            self.receive_binary(data, addr)
+        else:
+            self.receive_text(data, addr)
+        if self.accounting is not None:
+            self.accounting.add(f'udp {self.host}:{self.port}', time.perf_counter() - start)
+
+    def receive_text(self, data, addr):
+        for reading in data.replace(b',', b' ').split():
+            key, sep, value = reading.partition(b'=')
+            sources = self.text_index.get(key)
+            if sources is None:
+                self.unknown_count += 1
+                logging.debug(f"Unknown UDP reading ID {key} from {addr[0]}")
+                continue
+            try:
+                power = float(value)
+            except ValueError:
+                self.malformed_count += 1
+                logging.debug(f"Malformed UDP reading {reading} from {addr[0]}")
+                continue
+            self.reading_count += 1
+            for ds in sources:
+                self.update_source(ds, power)
+
+    def receive_binary(self, data, addr):
+        body = memoryview(data)[len(BINARY_MAGIC):]
+        usable = len(body) - len(body) % BINARY_RECORD.size
+        if usable != len(body):
+            self.malformed_count += 1
+            logging.debug(f"Truncated binary UDP datagram from {addr[0]}")
+        for binary_id, power in BINARY_RECORD.iter_unpack(body[:usable]):
+            sources = self.binary_index.get(binary_id)
+            if sources is None:
+                self.unknown_count += 1
+                logging.debug(f"Unknown binary UDP reading ID {binary_id} from {addr[0]}")
+                continue
+            self.reading_count += 1
+            for ds in sources:
+                self.update_source(ds, power)
+
+    def update_source(self, ds, power):
+        # Pass a reading to a data source, accounting for the time taken if enabled
+        if self.accounting is None:
+            ds.update_power(power)
+            return
+        start = time.perf_counter()
+        ds.update_power(power)
+        self.accounting.add(f'plug {ds.identifier}', time.perf_counter() - start)
+
+    def error_received(self, exc):
+        logging.warning(f"UDP ingest socket error: {exc}")
+
+    def stats(self):
+        return {
+            'data_sources': len(self.data_sources),
+            'datagrams': self.datagram_count,
+            'readings': self.reading_count,
+            'unknown': self.unknown_count,
+            'malformed': self.malformed_count,
+        }
+
+
+if __name__ == "__main__":
+    pass
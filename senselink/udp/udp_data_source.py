@@ -0,0 +1,62 @@
+# Copyright 2022, Charles Powell
+import asyncio
+import logging
+from math import isclose, isfinite
+from senselink.data_source import DataSource
+from .udp_controller import UDPController
+
+
+class UDPSource(DataSource):
+    # Primary output property
+    _power = 0.0
+    timer = None
+    _timeout_deadline = None
+
+    def add_controller(self, controller):
+        # Add self to passed-in UDP Data Controller
+        if not isinstance(controller, UDPController):
+            raise TypeError(
+                f"Incorrect controller type {type(controller).__name__} passed to UDP Data Source")
+        super().add_controller(controller)
+
+    def __init__(self, identifier, details, controller):
+        super().__init__(identifier, details, controller)
+        self.udp_id = str(identifier)
+        self.binary_id = None
+        self.timeout_duration = None
+
+        if details is not None:
+            # ID used by devices in text readings, defaults to the plug ID
+            self.udp_id = str(details.get('udp_id') or identifier)
+            # Numeric ID used by devices in binary readings
+            self.binary_id = details.get('binary_id')
+            if self.binary_id is not None and not 0 <= self.binary_id <= 0xFFFF:
+                raise AssertionError(f"Configuration Error: UDP plug {identifier} binary_id must be 0 to 65535")
+            self.timeout_duration = details.get('timeout_duration') or None
+
+    def timeout(self):
+        # Timer may have been set before the most recent reading, so check deadline
+        loop = asyncio.get_event_loop()
+        remaining = self._timeout_deadline - loop.time()
+        if remaining > 0:
+            self.timer = loop.call_later(remaining, self.timeout)
+            return
+        self.timer = None
+        logging.info(f'Update timeout reached for {self.identifier}, setting to off_usage')
+        self.set_power(self.off_usage)
+        self.state = False
+
+    def update_power(self, power):
+        if not isfinite(power):
+            logging.debug(f'Ignoring non-finite UDP reading for {self.identifier}')
+            return
+        if self.timeout_duration is not None:
+            # Push back the timeout deadline, only creating a timer if one isn't pending
+            loop = asyncio.get_event_loop()
+            self._timeout_deadline = loop.time() + self.timeout_duration
+            if self.timer is None:
+                self.timer = loop.call_later(self.timeout_duration, self.timeout)
+
+        self.set_power(power)
+        # Assume off if reported power usage is close to off_usage
+        self.state = not isclose(power, self.off_usage)
@@ -20,6 +20,9 @@ setup(
                       'PyYAML~=6.0',
                       'websockets>=10.2'
                       ],
+    extras_require={
+        'uvloop': ['uvloop']
+    },
 
     classifiers=[
         'Programming Language :: Python :: 3.7',